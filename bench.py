@@ -0,0 +1,341 @@
+"""Headless load generator and latency benchmark for the whiteboard server.
+
+Starts server.py (or targets one already running), connects synthetic clients
+that speak the same protocol as WhiteboardClient -- a hello, then one frame of
+segments per flush interval while drawing -- and measures how long each batch
+takes to reach every other member of its board. The result is printed as a
+single JSON object so runs can be stored and compared.
+
+Every flushed batch starts a new polyline whose first point encodes the sender
+and a sequence number, so receivers match it to its send time without extra
+fields on the wire; the marker survives the server's --simplify stage, which
+keeps polyline endpoints.
+"""
+import argparse
+import asyncio
+import json
+import os
+import shlex
+import socket
+import subprocess
+import sys
+import time
+
+from protocol import (BINARY_CODEC, JSON_CODEC, RECV_SIZE, FrameDecoder, decode_message, decode_payload,
+                      decode_sequenced, encode_message, encode_segments, is_control, is_sequenced)
+
+FLUSH_INTERVAL = 0.016  # same window as client.FLUSH_INTERVAL_MS
+MARK_STRIDE = 1024  # x of a batch's first point is sender * MARK_STRIDE; no other point lands on a multiple
+SLOW_READ_SIZE = 4096
+SAMPLE_INTERVAL = 0.5
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+def percentiles(samples):
+    """p50/p99/p999/max of latencies in seconds, reported in milliseconds."""
+    if not samples:
+        return {"samples": 0}
+    ordered = sorted(samples)
+
+    def pick(q):
+        return round(1000 * ordered[min(len(ordered) - 1, int(q * len(ordered)))], 3)
+    return {"samples": len(ordered), "p50": pick(0.5), "p99": pick(0.99), "p999": pick(0.999),
+            "max": round(1000 * ordered[-1], 3)}
+
+
+def process_tree(pid):
+    """pid and all of its descendants, from /proc."""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    parent = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(parent, []).append(int(entry))
+    tree = [pid]
+    for current in tree:
+        tree.extend(children.get(current, ()))
+    return tree
+
+
+def process_usage(pid):
+    """(CPU seconds, resident bytes) of a process tree, or None where /proc is unavailable."""
+    if not os.path.isdir("/proc"):
+        return None
+    cpu = rss = 0
+    for member in process_tree(pid):
+        try:
+            with open(f"/proc/{member}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            with open(f"/proc/{member}/status") as f:
+                rss += next((int(line.split()[1]) * 1024 for line in f if line.startswith("VmRSS:")), 0)
+        except (OSError, IndexError, ValueError):
+            continue
+        cpu += (int(fields[11]) + int(fields[12])) / CLOCK_TICKS  # utime, stime
+    return cpu, rss
+
+
+class Recorder:
+    """Send times of marked batches and what every client received, shared by all clients."""
+
+    def __init__(self):
+        self.send_times = {}  # (sender, seq) -> perf_counter at send
+        self.measuring = False
+        self.segments_sent = 0
+        self.bytes_sent = 0
+        self.batches_sent = 0
+        self.expected = 0  # batch deliveries owed to receivers while measuring
+        self.segments_received = 0
+        self.bytes_received = 0
+        self.latencies = []
+        self.slow_latencies = []
+        self.disconnected = 0
+
+
+class BenchClient:
+    def __init__(self, index, board, recorder, args, drawing=False, slow=False):
+        self.index = index
+        self.board = board
+        self.recorder = recorder
+        self.args = args
+        self.drawing = drawing
+        self.slow = slow
+        self.room_size = 1
+        self.joined = asyncio.Event()
+        self.reader = self.writer = None
+        self.pen = {"pen_color": 0xff000000 | (index * 2654435761 & 0xffffff), "pen_width": 3,
+                    "pen_style": "solid", "pen_cap": "round"}
+
+    async def connect(self, host, port):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        self.writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.writer.write(encode_message({"type": "hello", "codecs": [self.args.codec], "board": self.board}))
+
+    async def receive(self):
+        recorder = self.recorder
+        latencies = recorder.slow_latencies if self.slow else recorder.latencies
+        decoder = FrameDecoder()
+        read_size = SLOW_READ_SIZE if self.slow else RECV_SIZE
+        try:
+            while True:
+                data = await self.reader.read(read_size)
+                if not data:
+                    break
+                now = time.perf_counter()
+                for payload in decoder.feed(data):
+                    if is_control(payload):
+                        if decode_message(payload).get("type") == "joined":
+                            self.joined.set()
+                        continue
+                    if not recorder.measuring:
+                        continue
+                    size = len(payload) + 4
+                    if is_sequenced(payload):
+                        _, payload = decode_sequenced(payload)
+                    message = decode_payload(payload)
+                    segments = message if isinstance(message, list) else [message]
+                    recorder.segments_received += len(segments)
+                    recorder.bytes_received += size
+                    for segment in segments:
+                        x = segment.get("last_point_x")
+                        if x is not None and x % MARK_STRIDE == 0:
+                            sent = recorder.send_times.get((x // MARK_STRIDE, segment["last_point_y"]))
+                            if sent is not None:
+                                latencies.append(now - sent)
+                if self.slow:
+                    await asyncio.sleep(len(data) / (self.args.slow_rate * 1024))
+        except (ConnectionError, OSError):
+            pass
+        recorder.disconnected += 1
+
+    def batch(self, seq, count):
+        x, y = self.index * MARK_STRIDE, seq
+        segments = []
+        for step in range(1, count + 1):
+            segments.append({"last_point_x": x, "last_point_y": y, "current_point_x": self.index * MARK_STRIDE + step,
+                             "current_point_y": seq, **self.pen})
+            x = self.index * MARK_STRIDE + step
+        return segments
+
+    async def draw(self, stop_at):
+        """Send a batch every flush interval at the configured segment rate until stop_at."""
+        recorder = self.recorder
+        per_flush = self.args.rate * FLUSH_INTERVAL
+        count = min(max(1, round(per_flush)), MARK_STRIDE - 1)
+        interval = FLUSH_INTERVAL * count / per_flush
+        seq = 0
+        next_send = time.perf_counter()
+        while next_send < stop_at:
+            seq += 1
+            frame = encode_segments(self.batch(seq, count), self.args.codec)
+            sent = time.perf_counter()
+            if recorder.measuring:
+                recorder.send_times[(self.index, seq)] = sent
+                recorder.segments_sent += count
+                recorder.bytes_sent += len(frame)
+                recorder.batches_sent += 1
+                recorder.expected += self.room_size - 1
+            self.writer.write(frame)
+            await self.writer.drain()
+            next_send += interval
+            await asyncio.sleep(max(0.0, next_send - time.perf_counter()))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_for_server(host, port, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+async def sample_server(pid, samples):
+    while True:
+        usage = process_usage(pid)
+        if usage is not None:
+            samples.append(usage)
+        await asyncio.sleep(SAMPLE_INTERVAL)
+
+
+async def run(args, host, port, server_pid):
+    recorder = Recorder()
+    boards = max(1, args.clients // args.room_size)
+    clients = []
+    for index in range(args.clients):
+        board_index, seat = index % boards, index // boards
+        clients.append(BenchClient(index + 1, f"bench-{board_index}", recorder, args,
+                                   drawing=seat < args.drawers, slow=False))
+    for client in [client for client in clients if not client.drawing][:args.slow_peers]:
+        client.slow = True
+    for client in clients:
+        client.room_size = sum(1 for other in clients if other.board == client.board)
+
+    await wait_for_server(host, port)
+    for client in clients:
+        await client.connect(host, port)
+    receivers = [asyncio.create_task(client.receive()) for client in clients]
+    await asyncio.wait_for(asyncio.gather(*(client.joined.wait() for client in clients)), 30)
+
+    samples = []
+    sampler = asyncio.create_task(sample_server(server_pid, samples)) if server_pid else None
+    started = time.perf_counter()
+    stop_at = started + args.warmup + args.duration
+    drawers = [asyncio.create_task(client.draw(stop_at)) for client in clients if client.drawing]
+    await asyncio.sleep(args.warmup)
+    usage_start = process_usage(server_pid) if server_pid else None
+    bench_cpu = time.process_time()
+    recorder.measuring = True
+    measure_start = time.perf_counter()
+    await asyncio.gather(*drawers)
+    measured = time.perf_counter() - measure_start
+    usage_end = process_usage(server_pid) if server_pid else None
+    bench_cpu = time.process_time() - bench_cpu
+    await asyncio.sleep(args.drain)  # let in-flight batches arrive before the counts are read
+    recorder.measuring = False
+    if sampler is not None:
+        sampler.cancel()
+    for client in clients:
+        client.close()
+    for task in receivers:
+        task.cancel()
+
+    delivered = len(recorder.latencies) + len(recorder.slow_latencies)
+    result = {
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "boards": boards,
+        "drawers": sum(client.drawing for client in clients),
+        "measured_s": round(measured, 3),
+        "segments_sent": recorder.segments_sent,
+        "segments_received": recorder.segments_received,
+        "send_rate": round(recorder.segments_sent / measured, 1),
+        "delivery_rate": round(recorder.segments_received / measured, 1),
+        "batch_delivery_ratio": round(delivered / recorder.expected, 4) if recorder.expected else None,
+        "latency_ms": percentiles(recorder.latencies),
+        "slow_peer_latency_ms": percentiles(recorder.slow_latencies),
+        "bytes_per_segment": {
+            "sent": round(recorder.bytes_sent / recorder.segments_sent, 2) if recorder.segments_sent else None,
+            "received": (round(recorder.bytes_received / recorder.segments_received, 2)
+                         if recorder.segments_received else None),
+        },
+        "disconnected_during_run": recorder.disconnected,
+        "bench_cpu_percent": round(100 * bench_cpu / measured, 1),
+    }
+    if usage_start is not None and usage_end is not None:
+        result["server"] = {
+            "cpu_percent": round(100 * (usage_end[0] - usage_start[0]) / measured, 1),
+            "cpu_seconds": round(usage_end[0] - usage_start[0], 3),
+            "rss_mb": round(usage_end[1] / 2 ** 20, 1),
+            "rss_peak_mb": round(max(rss for _, rss in samples) / 2 ** 20, 1) if samples else None,
+        }
+    return result
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load and latency benchmark for the whiteboard server")
+    parser.add_argument("--clients", type=int, default=20, help="synthetic clients (default: %(default)s)")
+    parser.add_argument("--room-size", type=int, default=10, help="clients per board (default: %(default)s)")
+    parser.add_argument("--drawers", type=int, default=2, help="clients drawing in each room (default: %(default)s)")
+    parser.add_argument("--rate", type=float, default=120,
+                        help="segments per second from each drawer, sent every 16 ms (default: %(default)s)")
+    parser.add_argument("--slow-peers", type=int, default=0,
+                        help="non-drawing clients that read slowly, spread over the rooms (default: %(default)s)")
+    parser.add_argument("--slow-rate", type=float, default=64, help="KB/s a slow peer reads (default: %(default)s)")
+    parser.add_argument("--codec", choices=(BINARY_CODEC, JSON_CODEC), default=BINARY_CODEC)
+    parser.add_argument("--duration", type=float, default=10, help="measured seconds (default: %(default)s)")
+    parser.add_argument("--warmup", type=float, default=2, help="seconds drawn before measuring (default: %(default)s)")
+    parser.add_argument("--drain", type=float, default=2,
+                        help="seconds to wait for in-flight strokes after drawing stops (default: %(default)s)")
+    parser.add_argument("--mode", default="threaded", help="server --mode when the benchmark starts the server")
+    parser.add_argument("--server-args", default="",
+                        help='extra server.py arguments, e.g. "--workers 4 --slow-policy drop"')
+    parser.add_argument("--connect", metavar="HOST:PORT",
+                        help="benchmark a running server instead of starting one (no server CPU/memory figures)")
+    parser.add_argument("--output", help="also write the JSON result to this file")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    server = None
+    if args.connect:
+        host, port = args.connect.rsplit(":", 1)
+        port = int(port)
+    else:
+        host, port = "127.0.0.1", free_port()
+        server = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                "server.py"),
+                                   "--host", host, "--port", str(port), "--mode", args.mode,
+                                   *shlex.split(args.server_args)],
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        result = asyncio.run(run(args, host, int(port), server.pid if server else None))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
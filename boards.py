@@ -0,0 +1,162 @@
+"""Server-side history of every board, used to bring late joiners up to date.
+
+Each board keeps an append-only log of the stroke payloads relayed on it. Once
+the log's tail grows past SNAPSHOT_INTERVAL payloads it is folded into the
+snapshot: the tail's segments are decoded once and re-packed as large binary
+stroke batches, so connected segments from many small client flushes share a
+single run header. Folding runs on the store's compactor thread, away from the
+board lock that fan-out holds; until a folded tail's chunks are in place the
+tail itself stays part of the replay. A joining client is sent the snapshot
+chunks followed by whatever is not folded yet.
+
+Every payload appended or restored also takes the next number in the board's
+order, which clients use to tell whether they saw every stroke in sequence.
+"""
+import queue
+import struct
+import threading
+from collections import deque
+
+from protocol import decode_payload, encode_json, encode_strokes
+
+SNAPSHOT_INTERVAL = 256  # tail payloads folded into the snapshot at a time
+SNAPSHOT_CHUNK_SEGMENTS = 16384  # segments per snapshot payload, well below the codec's run limit
+
+
+def payload_segments(payload):
+    message = decode_payload(payload)
+    return message if isinstance(message, list) else [message]
+
+
+def pack_segments(segments):
+    """Binary payload for segments, or JSON if a segment does not fit a binary run."""
+    try:
+        return encode_strokes(segments)
+    except (ValueError, struct.error):
+        return encode_json(segments)
+
+
+def pack_payloads(payloads):
+    """Snapshot chunks holding the segments of payloads, and how many segments that is."""
+    segments = [segment for payload in payloads for segment in payload_segments(payload)]
+    chunks = [pack_segments(segments[start:start + SNAPSHOT_CHUNK_SEGMENTS])
+              for start in range(0, len(segments), SNAPSHOT_CHUNK_SEGMENTS)]
+    return chunks, len(segments)
+
+
+class Compactor:
+    """Folds board tails into their snapshots on one background thread, in the order they were handed over."""
+
+    def __init__(self):
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def fold(self, state, payloads):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        self._queue.put((state, payloads))
+
+    def _run(self):
+        while True:
+            state, payloads = self._queue.get()
+            try:
+                chunks, segment_count = pack_payloads(payloads)
+            except Exception as e:  # one bad payload must not stop folding for every board
+                print(f"Error compacting board {state.name}, keeping {len(payloads)} payloads unfolded: {e}")
+                chunks, segment_count = list(payloads), 0
+            state.folded(payloads, chunks, segment_count)
+
+
+class BoardState:
+    """Snapshot plus tail of one board's strokes.
+
+    Callers hold `lock` across appending and picking the recipients of a
+    payload, and across registering a joiner and sending it the replay, so every
+    payload reaches each member exactly once and in log order.
+    """
+
+    def __init__(self, name, compactor):
+        self.name = name
+        self.lock = threading.RLock()
+        self.compactor = compactor
+        self.snapshot = []
+        self.folding = deque()  # tails handed to the compactor, oldest first, replayed until folded
+        self.tail = []
+        self.segment_count = 0
+        self.sequence = 0  # order of the newest payload
+
+    def append(self, payload, order=None):
+        """Log a payload and return its order: the next one, or the owner's when the board is sharded."""
+        self.sequence = order if order is not None else self.sequence + 1
+        self.tail.append(payload)
+        if len(self.tail) >= SNAPSHOT_INTERVAL:
+            self.compact()
+        return self.sequence
+
+    def restore(self, payload):
+        """Add a payload recovered from the journal or sent by the board's owner.
+
+        Restored payloads take the same path as appended ones, so the compactor
+        folds them in the background like live strokes.
+        """
+        self.append(payload)
+
+    def checkpoint(self):
+        """(order, snapshot chunks, payloads not folded yet) for the journal's checkpoint; call under the lock."""
+        pending = [payload for payloads in self.folding for payload in payloads] + self.tail
+        return self.sequence, list(self.snapshot), pending
+
+    def load(self, sequence, chunks, pending):
+        """Start from a checkpoint: its chunks as they are, its unfolded payloads through the compactor."""
+        self.snapshot.extend(chunks)
+        for payload in pending:
+            self.append(payload)
+        self.sequence = sequence
+
+    def compact(self):
+        """Hand the tail to the compactor; it stays in the replay until its chunks replace it."""
+        self.folding.append(self.tail)
+        self.compactor.fold(self, self.tail)
+        self.tail = []
+
+    def folded(self, payloads, chunks, segment_count):
+        """Swap a folded tail for its snapshot chunks, unless the board was cleared meanwhile."""
+        with self.lock:
+            if self.folding and self.folding[0] is payloads:
+                self.folding.popleft()
+                self.snapshot.extend(chunks)
+                self.segment_count += segment_count
+
+    def replay(self):
+        """Payloads that rebuild the board from blank, oldest first."""
+        return self.snapshot + [payload for payloads in self.folding for payload in payloads] + self.tail
+
+    def clear(self):
+        self.snapshot = []
+        self.folding = deque()
+        self.tail = []
+        self.segment_count = 0
+        self.sequence = 0
+
+
+class BoardStore:
+    """Thread-safe lookup of board states, creating them on first use."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._boards = {}
+        self.compactor = Compactor()
+
+    def get(self, name):
+        with self._lock:
+            state = self._boards.get(name)
+            if state is None:
+                state = self._boards[name] = BoardState(name, self.compactor)
+            return state
+
+    def names(self):
+        with self._lock:
+            return list(self._boards)
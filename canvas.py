@@ -0,0 +1,373 @@
+import math
+import zlib
+from collections import OrderedDict
+
+from PyQt6.QtCore import QPoint, QPointF, QRect, QSize, Qt, QTimer
+from PyQt6.QtGui import QGuiApplication, QImage, QPainter, QRegion
+from PyQt6.QtWidgets import QWidget
+
+DEFAULT_REFRESH_RATE = 60
+TILE_SIZE = 256
+TILE_FORMAT = QImage.Format.Format_ARGB32_Premultiplied
+TILE_BYTES = TILE_SIZE * TILE_SIZE * 4
+DEFAULT_MEMORY_BUDGET = 64 * 1024 * 1024  # uncompressed tiles kept before off-screen ones are evicted
+MIN_SCALE, MAX_SCALE = 0.1, 8.0
+ZOOM_STEP = 1.25
+
+
+def tile_range(left, top, right, bottom):
+    """Keys of every tile overlapping the inclusive board rectangle."""
+    for ty in range(top // TILE_SIZE, bottom // TILE_SIZE + 1):
+        for tx in range(left // TILE_SIZE, right // TILE_SIZE + 1):
+            yield tx, ty
+
+
+def tile_bounds(key):
+    """Inclusive (left, top, right, bottom) board rectangle of a tile."""
+    tx, ty = key
+    return tx * TILE_SIZE, ty * TILE_SIZE, tx * TILE_SIZE + TILE_SIZE - 1, ty * TILE_SIZE + TILE_SIZE - 1
+
+
+def redraw_tile(key, rasterize):
+    """A fresh tile with rasterize(painter, bounds) drawn onto it."""
+    tx, ty = key
+    image = QImage(TILE_SIZE, TILE_SIZE, TILE_FORMAT)
+    image.fill(Qt.GlobalColor.white)
+    painter = QPainter(image)
+    painter.translate(-tx * TILE_SIZE, -ty * TILE_SIZE)
+    rasterize(painter, tile_bounds(key))
+    painter.end()
+    return image
+
+
+def deflate_tile(image):
+    return zlib.compress(image.constBits().asstring(image.sizeInBytes()), 1)
+
+
+def inflate_tile(data):
+    return QImage(zlib.decompress(data), TILE_SIZE, TILE_SIZE, TILE_SIZE * 4, TILE_FORMAT).copy()
+
+
+class TiledCanvas:
+    """Sparse, unbounded board storage made of fixed-size tiles.
+
+    A tile is allocated the first time something is drawn on it, so memory
+    follows the inked area rather than the board's extent. Once the
+    uncompressed tiles exceed the memory budget, the least recently used ones
+    that are not pinned (on screen) are evicted: deflated, or, when a rasterize
+    callback can redraw a region from retained strokes, dropped outright and
+    rebuilt on next use.
+
+    Tiles painted on are also recorded as dirty until take_dirty() collects
+    them, so previews can follow the board without rescanning it.
+    """
+
+    def __init__(self, memory_budget=DEFAULT_MEMORY_BUDGET, rasterize=None, freeze=None):
+        self.memory_budget = memory_budget
+        self.rasterize = rasterize  # rasterize(painter, (left, top, right, bottom)) in board space
+        self.freeze = freeze  # freeze(regions) -> rasterize callback over a copy of the strokes, usable off-thread
+        self.tiles = OrderedDict()  # (tx, ty) -> QImage, least recently used first
+        self.compressed = {}  # (tx, ty) -> deflated pixels of an evicted tile
+        self.discarded = set()  # evicted tiles to redraw with rasterize
+        self.pinned = set()
+        self.dirty = set()
+
+    def tile(self, key, create=False):
+        """The tile at key, restoring it if it was evicted; None if it was never drawn on."""
+        return self._load(key, create)[0]
+
+    def _load(self, key, create):
+        """(tile, whether it was just redrawn from the retained strokes), as tile() finds or restores it."""
+        image = self.tiles.get(key)
+        if image is not None:
+            self.tiles.move_to_end(key)
+            return image, False
+        redrawn = False
+        data = self.compressed.pop(key, None)
+        if data is not None:
+            image = inflate_tile(data)
+        elif key in self.discarded:
+            self.discarded.remove(key)
+            image = redraw_tile(key, self.rasterize)
+            redrawn = True
+        elif create:
+            image = QImage(TILE_SIZE, TILE_SIZE, TILE_FORMAT)
+            image.fill(Qt.GlobalColor.white)
+        else:
+            return None, False
+        self.tiles[key] = image
+        return image, redrawn
+
+    def peek(self, key):
+        """The tile at key without promoting or restoring it into the cache."""
+        image = self.tiles.get(key)
+        if image is None and key in self.compressed:
+            image = inflate_tile(self.compressed[key])
+        elif image is None and key in self.discarded:
+            image = redraw_tile(key, self.rasterize)
+        return image
+
+    def evict(self):
+        while len(self.tiles) * TILE_BYTES > self.memory_budget:
+            victim = next((key for key in self.tiles if key not in self.pinned), None)
+            if victim is None:
+                break
+            image = self.tiles.pop(victim)
+            if self.rasterize is not None:
+                self.discarded.add(victim)
+            else:
+                self.compressed[victim] = deflate_tile(image)
+
+    def paint(self, items):
+        """Run draw callbacks on every tile their bounds touch.
+
+        items is a list of ((left, top, right, bottom), draw) in board
+        coordinates; draw(painter) gets a painter translated to board space.
+        Each touched tile gets one painter, and the callbacks run in list order.
+        Callers hand what they draw to the rasterize callback's strokes first,
+        so a discarded tile redrawn here already shows it and is not drawn on
+        again, which would blend translucent strokes twice.
+        """
+        by_tile = {}
+        for bounds, draw in items:
+            for key in tile_range(*bounds):
+                by_tile.setdefault(key, []).append(draw)
+        self.dirty.update(by_tile)
+        for (tx, ty), draws in by_tile.items():
+            image, redrawn = self._load((tx, ty), True)
+            if redrawn:
+                continue
+            painter = QPainter(image)
+            painter.translate(-tx * TILE_SIZE, -ty * TILE_SIZE)
+            for draw in draws:
+                draw(painter)
+            painter.end()
+        self.evict()
+
+    def render(self, painter, left, top, right, bottom):
+        """Draw the inked tiles overlapping a board rectangle onto a board-space painter."""
+        for tx, ty in tile_range(left, top, right, bottom):
+            image = self.tile((tx, ty))
+            if image is not None:
+                painter.drawImage(tx * TILE_SIZE, ty * TILE_SIZE, image)
+        self.evict()
+
+    def keys(self):
+        return set(self.tiles) | set(self.compressed) | self.discarded
+
+    def inked_rect(self):
+        """Board rectangle covering every tile that has been drawn on."""
+        keys = self.keys()
+        if not keys:
+            return QRect()
+        xs = [tx for tx, _ in keys]
+        ys = [ty for _, ty in keys]
+        return QRect(min(xs) * TILE_SIZE, min(ys) * TILE_SIZE,
+                     (max(xs) - min(xs) + 1) * TILE_SIZE, (max(ys) - min(ys) + 1) * TILE_SIZE)
+
+    def redraw(self, regions):
+        """Rebuild every tile touching the regions with rasterize; returns their keys.
+
+        Used when strokes already painted turn out to belong in a different
+        order, so the tiles are rebuilt from the retained strokes.
+        """
+        keys = {key for bounds in regions for key in tile_range(*bounds)}
+        for key in keys:
+            self.compressed.pop(key, None)
+            self.discarded.discard(key)
+            self.tiles[key] = redraw_tile(key, self.rasterize)
+            self.tiles.move_to_end(key)
+        self.dirty.update(keys)
+        self.evict()
+        return keys
+
+    def snapshot(self):
+        """Freeze the board's current pixels into a BoardSnapshot for reading on another thread."""
+        tiles = {key: QImage(image) for key, image in self.tiles.items()}  # shared until the canvas paints again
+        discarded = set(self.discarded)
+        rasterize = None
+        if discarded and self.freeze is not None:
+            rasterize = self.freeze([tile_bounds(key) for key in discarded])
+        elif discarded:
+            tiles.update((key, self.peek(key)) for key in discarded)
+            discarded = set()
+        return BoardSnapshot(self.inked_rect(), tiles, dict(self.compressed), discarded, rasterize)
+
+    def take_dirty(self):
+        """Tiles painted on since the last call."""
+        dirty, self.dirty = self.dirty, set()
+        return dirty
+
+    def clear(self):
+        self.tiles.clear()
+        self.compressed.clear()
+        self.discarded.clear()
+        self.dirty.clear()
+
+
+class BoardSnapshot:
+    """Immutable copy of a TiledCanvas that another thread can read while drawing carries on.
+
+    Resident tiles are shared copy-on-write with the canvas, which detaches its
+    own copy the next time it paints on one; evicted tiles keep their deflated
+    bytes, and discarded ones are redrawn by a rasterize callback that only
+    reads frozen strokes.
+    """
+
+    def __init__(self, rect, tiles, compressed, discarded, rasterize):
+        self.rect = rect if not rect.isEmpty() else QRect(0, 0, 1, 1)
+        self.tiles = tiles
+        self.compressed = compressed
+        self.discarded = discarded
+        self.rasterize = rasterize
+        self.rows = {}  # ty -> tx of the tiles in that row
+        for tx, ty in set(tiles) | set(compressed) | discarded:
+            self.rows.setdefault(ty, []).append(tx)
+
+    def tile(self, key):
+        image = self.tiles.get(key)
+        if image is None and key in self.compressed:
+            image = inflate_tile(self.compressed[key])
+        elif image is None and key in self.discarded:
+            image = redraw_tile(key, self.rasterize)
+        return image
+
+    def bands(self):
+        """Yield the board one row of tiles at a time, as images as wide as the board and at most a tile tall."""
+        rect = self.rect
+        for ty in range(rect.top() // TILE_SIZE, rect.bottom() // TILE_SIZE + 1):
+            top = max(rect.top(), ty * TILE_SIZE)
+            bottom = min(rect.bottom(), ty * TILE_SIZE + TILE_SIZE - 1)
+            band = QImage(rect.width(), bottom - top + 1, TILE_FORMAT)
+            band.fill(Qt.GlobalColor.white)
+            painter = QPainter(band)
+            painter.translate(-rect.x(), -top)
+            for tx in self.rows.get(ty, ()):
+                painter.drawImage(tx * TILE_SIZE, ty * TILE_SIZE, self.tile((tx, ty)))
+            painter.end()
+            yield band
+
+
+class CanvasWidget(QWidget):
+    """Pan/zoom view onto a TiledCanvas, repainting only regions drawn on since the last frame.
+
+    Drawing code hands paint() callbacks with board-space bounds; the touched
+    area is accumulated as damage and flushed at most once per display refresh,
+    so a burst of segments costs one partial repaint.
+
+    Middle-drag or the wheel pans; Ctrl+wheel zooms around the cursor. Other
+    mouse events are ignored so they reach the window's drawing handlers.
+    """
+
+    def __init__(self, memory_budget=DEFAULT_MEMORY_BUDGET, rasterize=None, freeze=None):
+        super().__init__()
+        self.board = TiledCanvas(memory_budget, rasterize, freeze)
+        self.origin = QPointF(0, 0)  # board point shown at the widget's top-left corner
+        self.scale = 1.0
+        self.pan_anchor = None
+        self.damage = QRegion()
+        self.setAttribute(Qt.WidgetAttribute.WA_OpaquePaintEvent)  # we cover every exposed pixel ourselves
+
+        screen = QGuiApplication.primaryScreen()
+        refresh_rate = screen.refreshRate() if screen else 0
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setSingleShot(True)
+        self.refresh_timer.setInterval(int(1000 / (refresh_rate or DEFAULT_REFRESH_RATE)))
+        self.refresh_timer.timeout.connect(self.flush_damage)
+
+    def sizeHint(self):
+        return QSize(1920, 1080)
+
+    def to_board(self, point):
+        """Board coordinates of a widget position."""
+        return QPoint(math.floor(self.origin.x() + point.x() / self.scale),
+                      math.floor(self.origin.y() + point.y() / self.scale))
+
+    def board_bounds(self, rect):
+        """Inclusive (left, top, right, bottom) board rectangle covering a widget rect."""
+        top_left = self.to_board(rect.topLeft())
+        bottom_right = self.to_board(rect.bottomRight())
+        return top_left.x(), top_left.y(), bottom_right.x() + 1, bottom_right.y() + 1
+
+    def widget_rect(self, left, top, right, bottom):
+        """Widget rect covering an inclusive board rectangle."""
+        x = math.floor((left - self.origin.x()) * self.scale)
+        y = math.floor((top - self.origin.y()) * self.scale)
+        return QRect(x, y, math.ceil((right - left + 1) * self.scale) + 1,
+                     math.ceil((bottom - top + 1) * self.scale) + 1)
+
+    def paint(self, items):
+        """Draw on the board (see TiledCanvas.paint) and schedule the touched area for repaint."""
+        self.board.paint(items)
+        for bounds, _ in items:
+            self.mark_dirty(self.widget_rect(*bounds))
+
+    def redraw(self, regions):
+        """Rebuild the tiles touching board regions (see TiledCanvas.redraw) and schedule their repaint."""
+        for key in self.board.redraw(regions):
+            self.mark_dirty(self.widget_rect(*tile_bounds(key)))
+
+    def mark_dirty(self, rect):
+        """Schedule a repaint of rect (in widget coordinates) on the next refresh tick."""
+        self.damage = self.damage.united(rect.intersected(self.rect()))
+        if not self.refresh_timer.isActive():
+            self.refresh_timer.start()
+
+    def flush_damage(self):
+        if not self.damage.isEmpty():
+            self.update(self.damage)
+            self.damage = QRegion()
+
+    def clear(self):
+        self.board.clear()
+        self.update()
+
+    def set_view(self, origin, scale):
+        self.origin = origin
+        self.scale = min(MAX_SCALE, max(MIN_SCALE, scale))
+        self.board.pinned = set(tile_range(*self.board_bounds(self.rect())))
+        self.update()
+
+    def resizeEvent(self, event):
+        self.set_view(self.origin, self.scale)
+
+    def paintEvent(self, event):
+        rect = event.rect()  # Qt clips painting to the exact damaged region
+        painter = QPainter(self)
+        painter.fillRect(rect, Qt.GlobalColor.white)
+        painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform, self.scale < 1)
+        painter.scale(self.scale, self.scale)
+        painter.translate(-self.origin)
+        self.board.render(painter, *self.board_bounds(rect))
+        painter.end()
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.MouseButton.MiddleButton:
+            self.pan_anchor = event.position()
+        else:
+            event.ignore()
+
+    def mouseMoveEvent(self, event):
+        if self.pan_anchor is None:
+            event.ignore()
+            return
+        delta = event.position() - self.pan_anchor
+        self.pan_anchor = event.position()
+        self.set_view(self.origin - delta / self.scale, self.scale)
+
+    def mouseReleaseEvent(self, event):
+        if event.button() == Qt.MouseButton.MiddleButton:
+            self.pan_anchor = None
+        else:
+            event.ignore()
+
+    def wheelEvent(self, event):
+        steps = event.angleDelta().y() / 120
+        if event.modifiers() & Qt.KeyboardModifier.ControlModifier:
+            cursor = event.position()
+            anchor = self.origin + cursor / self.scale  # board point kept under the cursor
+            scale = min(MAX_SCALE, max(MIN_SCALE, self.scale * ZOOM_STEP ** steps))
+            self.set_view(anchor - cursor / scale, scale)
+        else:
+            pixels = QPointF(event.angleDelta().x(), event.angleDelta().y()) / 120 * 40
+            self.set_view(self.origin - pixels / self.scale, self.scale)
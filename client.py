@@ -1,17 +1,168 @@
-import json
 import sys
 import socket
 import threading
-from PyQt6.QtCore import Qt, QPoint, pyqtSignal
-from PyQt6.QtGui import QPixmap, QPainter, QPen, QColor
+import time
+from functools import lru_cache, partial
+from PyQt6.QtCore import Qt, QLine, QPoint, QTimer, pyqtSignal
+from PyQt6.QtGui import QPen, QColor, QPolygon, QIcon, QPixmap
 from PyQt6.QtWidgets import QApplication, QMainWindow, QLabel, QPushButton, QVBoxLayout, QWidget, QFileDialog, \
-    QColorDialog, QHBoxLayout, QDialog, QSlider, QRadioButton, QGridLayout, QButtonGroup, QCheckBox
+    QColorDialog, QHBoxLayout, QDialog, QSlider, QRadioButton, QGridLayout, QButtonGroup, QCheckBox, QListWidget, \
+    QListWidgetItem, QLineEdit
 import random
 
+from canvas import CanvasWidget
+from echo import LocalEcho
+from export import THUMBNAIL_SIZE, BoardThumbnail, write_png
+from inbox import StrokeInbox, batch_by_pen, segment_bounds
+from strokes import SPRAY, StrokeStore
+from protocol import (DEFAULT_BOARD, JSON_CODEC, MAX_BOARD_NAME, RECV_SIZE, SPRAY_PATTERNS, SPRAY_REACH,
+                      SUPPORTED_CODECS, FrameDecoder, decode_ack, decode_payload, decode_sequenced, encode_message,
+                      encode_segments, is_ack, is_sequenced, is_spray)
+
+FLUSH_INTERVAL_MS = 16  # segments drawn within one window are sent as a single frame
+DRAIN_INTERVAL_MS = 16  # how often queued remote segments are painted
+MAX_SEGMENTS_PER_TICK = 5000  # bounds the GUI time one tick can spend on remote strokes
+STATS_INTERVAL_MS = 1000
+THUMBNAIL_INTERVAL_MS = 2000  # how often the current board's preview catches up with its dirty tiles
+QT_PEN_STYLES = {"solid": Qt.PenStyle.SolidLine, "dash": Qt.PenStyle.DashLine}
+QT_PEN_CAPS = {"round": Qt.PenCapStyle.RoundCap, "square": Qt.PenCapStyle.SquareCap}
+
+
+def segment_pen(segment):
+    """Build the QPen described by the pen fields of a segment message."""
+    return QPen(QColor.fromRgba(segment["pen_color"]), segment["pen_width"], QT_PEN_STYLES[segment["pen_style"]],
+                QT_PEN_CAPS[segment["pen_cap"]], Qt.PenJoinStyle.RoundJoin)
+
+
+def draw_lines(painter, lines, color):
+    """Draw lines with the painter's pen.
+
+    One drawLines call strokes its lines as a single path, blending overlaps
+    once, so translucent lines go one at a time: the pixels then do not depend
+    on how segments happened to be batched when they arrived.
+    """
+    if color >> 24 == 0xFF:
+        painter.drawLines(lines)
+    else:
+        for line in lines:
+            painter.drawLine(line)
+
+
+def draw_stroke(painter, stroke, pen):
+    """Redraw a retained stroke; pen is its interned pen key.
+
+    Lines are drawn segment by segment, as draw_group painted them live, so a
+    redrawn tile comes out pixel for pixel the same.
+    """
+    points = stroke.points
+    if stroke.kind == SPRAY:
+        _, color, diameter, density = pen
+        painter.setPen(QPen(QColor.fromRgba(color), 1))
+        for i in range(0, len(points), 3):
+            painter.drawPoints(spray_pattern(points[i + 2], diameter, density).translated(points[i], points[i + 1]))
+    else:
+        color, width, style, cap = pen
+        painter.setPen(QPen(QColor.fromRgba(color), width, QT_PEN_STYLES[style], QT_PEN_CAPS[cap],
+                            Qt.PenJoinStyle.RoundJoin))
+        draw_lines(painter, [QLine(points[i], points[i + 1], points[i + 2], points[i + 3])
+                             for i in range(0, len(points) - 2, 2)], color)
+
+
+def rasterize_strokes(store, painter, bounds):
+    """Draw the strokes of a StrokeStore that cross a board region."""
+    for stroke in store.query(*bounds):
+        draw_stroke(painter, stroke, store.pens[stroke.pen])
+
+
+def rasterize_board(store, local, painter, bounds):
+    """Draw a board region: the ordered strokes of a StrokeStore, then our own not yet ordered ones on top."""
+    rasterize_strokes(store, painter, bounds)
+    left, top, right, bottom = bounds
+    for _, members, (m_left, m_top, m_right, m_bottom) in batch_by_pen(local):
+        if m_left <= right and left <= m_right and m_top <= bottom and top <= m_bottom:
+            draw_group(members, painter)
+
+
+def draw_group(members, painter):
+    """Draw segments (or sprays) that share one pen."""
+    if is_spray(members[0]):
+        painter.setPen(QPen(QColor.fromRgba(members[0]["pen_color"]), 1))
+        for spray in members:
+            pattern = spray_pattern(spray["spray_seed"], spray["diameter"], spray["density"])
+            painter.drawPoints(pattern.translated(spray["x"], spray["y"]))
+    else:
+        painter.setPen(segment_pen(members[0]))
+        draw_lines(painter, [QLine(s["last_point_x"], s["last_point_y"], s["current_point_x"], s["current_point_y"])
+                             for s in members], members[0]["pen_color"])
+
+
+@lru_cache(maxsize=256)
+def spray_pattern(seed, diameter, density):
+    """Dot offsets of a spray around (0, 0); every peer derives the same dots from the same seed.
+
+    Sampling runs once per (seed, diameter, density). After that a spray is one
+    translated drawPoints call, however dense it is.
+    """
+    rng = random.Random(seed)
+    reach = SPRAY_REACH * diameter
+    return QPolygon([QPoint(int(max(-reach, min(reach, rng.gauss(0, diameter)))),
+                            int(max(-reach, min(reach, rng.gauss(0, diameter)))))
+                     for _ in range(density)])
+
+
 class BoardsDialog(QDialog):
-    def __init__(self):
+    board_selected = pyqtSignal(str)
+
+    def __init__(self, current_board, thumbnails):
         super().__init__()
         self.setWindowTitle("My Boards")
+        self.current_board = current_board
+        self.thumbnails = thumbnails  # board -> cached preview image, or None while blank
+
+        layout = QVBoxLayout()
+        self.status_label = QLabel("Loading boards...")
+        self.board_list = QListWidget()
+        self.board_list.setIconSize(THUMBNAIL_SIZE)
+        self.board_list.itemDoubleClicked.connect(self.handle_open)
+        self.board_name = QLineEdit()
+        self.board_name.setMaxLength(MAX_BOARD_NAME)
+        self.board_name.setPlaceholderText("New board name")
+        self.board_name.returnPressed.connect(self.handle_open)
+        self.open_btn = QPushButton("Open")
+        self.open_btn.clicked.connect(self.handle_open)
+
+        layout.addWidget(self.status_label)
+        layout.addWidget(self.board_list)
+        layout.addWidget(self.board_name)
+        layout.addWidget(self.open_btn)
+        self.setLayout(layout)
+        for board in thumbnails:  # boards seen before, shown until the server's listing arrives
+            self.add_board(board, board)
+
+    def add_board(self, name, label):
+        item = QListWidgetItem(label)
+        item.setData(Qt.ItemDataRole.UserRole, name)
+        thumbnail = self.thumbnails.get(name)
+        if thumbnail is not None:
+            item.setIcon(QIcon(QPixmap.fromImage(thumbnail)))
+        self.board_list.addItem(item)
+        if name == self.current_board:
+            self.board_list.setCurrentItem(item)
+
+    def set_boards(self, boards):
+        """Fill the list from the server's boards reply."""
+        self.board_list.clear()
+        for board in boards:
+            self.add_board(board["name"], f"{board['name']} ({board['members']} online)")
+        self.status_label.setText(f"Current board: {self.current_board}")
+
+    def handle_open(self):
+        name = self.board_name.text().strip()
+        if not name and self.board_list.currentItem():
+            name = self.board_list.currentItem().data(Qt.ItemDataRole.UserRole)
+        if name:
+            self.board_selected.emit(name)
+            self.close()
 
 class CustomDialog(QDialog):
     brushes_signal = pyqtSignal(dict)
@@ -95,7 +246,8 @@ class CustomDialog(QDialog):
 
 
 class WhiteboardClient(QMainWindow):
-    new_drawing_signal = pyqtSignal(dict)  # Signal to pass drawing data to the main thread
+    boards_signal = pyqtSignal(list)  # Board listings arriving on the receiver thread
+    export_signal = pyqtSignal(str)  # Progress of an export running on a worker thread
 
     def __init__(self, host="127.0.0.1", port=12345):
         super().__init__()
@@ -104,14 +256,20 @@ class WhiteboardClient(QMainWindow):
 
         self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.client_socket.connect((host, port))
+        self.codec = JSON_CODEC  # switched once the server answers our hello
+        self.board = DEFAULT_BOARD
+        self.client_socket.sendall(encode_message({"type": "hello", "codecs": list(SUPPORTED_CODECS)}))
 
         self.central_widget = QWidget()
         self.setCentralWidget(self.central_widget)
         self.layout = QVBoxLayout()
         self.central_widget.setLayout(self.layout)
 
-        self.canvas = QLabel()
-        self.canvas.setAlignment(Qt.AlignmentFlag.AlignTop | Qt.AlignmentFlag.AlignLeft)
+        self.strokes = StrokeStore()
+        self.canvas = CanvasWidget(rasterize=self.rasterize_region, freeze=self.freeze_strokes)
+        self.thumbnails = {self.board: BoardThumbnail()}
+        self.export_status = ""
+        self.export_signal.connect(self.show_export_status)
         self.layout.addWidget(self.canvas)
 
         self.button_layout = QHBoxLayout()
@@ -133,117 +291,269 @@ class WhiteboardClient(QMainWindow):
         self.brushes_button.clicked.connect(self.open_brushes_dialog)
         self.button_layout.addWidget(self.brushes_button)
 
-        self.canvas_width = 1920
-        self.canvas_height = 1080
-        self.pixmap = QPixmap(self.canvas_width, self.canvas_height)
-        self.pixmap.fill(Qt.GlobalColor.white)
-        self.canvas.setPixmap(self.pixmap)
-
         self.drawing = False
         self.last_point = QPoint()
         self.pen_color = QColor(Qt.GlobalColor.black)
 
+        self.echo = LocalEcho()  # our strokes until the server acks their place in the board's order
+        self.order = None  # board order of the newest stroke or ack received, tracked on the receiver thread
+        self.order_gaps = 0
+        self.rtt = None
+        self.flush_timer = QTimer(self)
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.setInterval(FLUSH_INTERVAL_MS)
+        self.flush_timer.timeout.connect(self.flush_segments)
+
+        # Remote segments are queued by the receiver thread and painted in batches on the GUI thread
+        self.inbox = StrokeInbox()
+        self.drain_timer = QTimer(self)
+        self.drain_timer.setInterval(DRAIN_INTERVAL_MS)
+        self.drain_timer.timeout.connect(self.apply_remote_strokes)
+        self.drain_timer.start()
+        self.stats_timer = QTimer(self)
+        self.stats_timer.setInterval(STATS_INTERVAL_MS)
+        self.stats_timer.timeout.connect(self.show_stats)
+        self.stats_timer.timeout.connect(self.send_ping)
+        self.stats_timer.start()
+        self.thumbnail_timer = QTimer(self)
+        self.thumbnail_timer.setInterval(THUMBNAIL_INTERVAL_MS)
+        self.thumbnail_timer.timeout.connect(self.update_thumbnail)
+        self.thumbnail_timer.start()
+
         # Start listening for incoming data
-        self.new_drawing_signal.connect(self.update_drawing)
         threading.Thread(target=self.receive_data, daemon=True).start()
         self.brush_settings = {"mode":"line", "opacity": 100, "diameter": 10, "density": 100, "width": 5,
                                "dashed": Qt.PenStyle.SolidLine, "cap_type": Qt.PenCapStyle.RoundCap}
 
-    def update_drawing(self, data):
-        """Handle received drawing data in the main thread."""
-        x1 = data.get("last_point_x")
-        y1 = data.get("last_point_y")
-        x2 = data.get("current_point_x")
-        y2 = data.get("current_point_y")
-        color = data.get("pen_color")
-
-        start_point = QPoint(x1, y1)
-        end_point = QPoint(x2, y2)
-        self.draw_line(start_point, end_point, color)
+    def apply_remote_strokes(self):
+        """Paint the segments queued since the last tick."""
+        items = self.inbox.drain(MAX_SEGMENTS_PER_TICK)
+        if not items:
+            return
+        started = time.perf_counter()
+        batch = []
+        for _, message in items:
+            kind = message.get("type")
+            if kind is None:
+                batch.append(message)
+                continue
+            self.draw_segments(batch)
+            batch = []
+            if kind == "joined":
+                self.on_board_joined(message["board"])
+            elif kind == "ack":
+                self.apply_ack(message["seq"], message["segments"])
+        self.draw_segments(batch)
+        self.inbox.record_paint(time.monotonic() - items[0][0], time.perf_counter() - started)
+
+    def draw_segments(self, segments):
+        """Draw many segments with one painter per touched tile, switching pens once per pen group.
+
+        Groups that land on our own unacknowledged strokes were ordered before
+        them, so those regions are redrawn with our strokes back on top.
+        """
+        if not segments:
+            return
+        self.strokes.add_segments(segments)
+        items = []
+        stale = []
+        for _, members, bounds in batch_by_pen(segments):
+            if self.echo.overlaps(bounds):
+                stale.append(bounds)
+            else:
+                items.append((bounds, partial(draw_group, members)))
+        self.canvas.paint(items)
+        if stale:
+            self.echo.reconciled += len(stale)
+            self.canvas.redraw(stale)
+
+    def draw_local(self, segment):
+        """Paint a segment or spray we just drew, ahead of its place in the board's order."""
+        self.echo.draw(segment)
+        self.canvas.paint([(segment_bounds(segment), partial(draw_group, [segment]))])
+
+    def apply_ack(self, sequence, segments):
+        """Move acknowledged strokes into the retained ones, or the server's rewrite of them if it sent one."""
+        acked = self.echo.ack(sequence)
+        if not acked:  # already retired by a later, cumulative ack
+            return
+        if segments is None:
+            self.strokes.add_segments(acked)
+            return
+        self.strokes.add_segments(segments)
+        self.canvas.redraw([segment_bounds(segment) for segment in acked + segments])
+
+    def rasterize_region(self, painter, bounds):
+        """Redraw the strokes crossing a board region, e.g. an evicted tile."""
+        rasterize_board(self.strokes, self.echo.segments(), painter, bounds)
+
+    def freeze_strokes(self, regions):
+        """Rasterize callback over a copy of the strokes crossing regions, for drawing off the GUI thread."""
+        return partial(rasterize_board, self.strokes.freeze(regions), self.echo.segments())
+
+    def update_thumbnail(self):
+        self.thumbnails[self.board].update(self.canvas.board)
+
+    def show_stats(self):
+        stats = self.inbox.stats()
+        echo = self.echo.stats()
+        self.statusBar().showMessage(
+            f"Remote queue {stats['depth']} (peak {stats['peak_depth']}, dropped {stats['dropped']}, "
+            f"merged {stats['merged']}) | paint latency p50 {stats['latency_p50_ms']:.1f} ms, "
+            f"p99 {stats['latency_p99_ms']:.1f} ms | batch paint {stats['paint_ms']:.1f} ms"
+            f" | RTT {f'{1000 * self.rtt:.1f} ms' if self.rtt is not None else '-'}, "
+            f"ack p50 {echo['ack_p50_ms']:.1f} ms, {echo['unacked']} unacked, {echo['reconciled']} reconciled, "
+            f"{self.order_gaps} order gaps"
+            + (f" | {self.export_status}" if self.export_status else ""))
+
+    def show_export_status(self, status):
+        self.export_status = status
+        self.show_stats()
 
     def receive_data(self):
         """Receive drawing data from the server."""
+        decoder = FrameDecoder()
         while True:
             try:
-                data = self.client_socket.recv(1024)
-                if data:
-                    data = json.loads(data.decode())
-                    self.new_drawing_signal.emit(data)  # Emit signal to update drawing
+                data = self.client_socket.recv(RECV_SIZE)
+                if not data:
+                    break
+                for payload in decoder.feed(data):
+                    if is_ack(payload):
+                        order, sequence, rewritten = decode_ack(payload)
+                        self.track_order(order)
+                        message = decode_payload(rewritten) if rewritten else None
+                        self.inbox.put_ordered({"type": "ack", "seq": sequence, "segments": (
+                            message if isinstance(message, list) or message is None else [message])})
+                        continue
+                    if is_sequenced(payload):
+                        order, payload = decode_sequenced(payload)
+                        self.track_order(order)
+                    message = decode_payload(payload)
+                    if isinstance(message, dict) and "type" in message:
+                        self.handle_control(message)
+                        continue
+                    self.inbox.put(message if isinstance(message, list) else [message])
             except Exception as e:
                 print(f"Error receiving data: {e}")
                 break
 
+    def track_order(self, order):
+        """Count breaks in the board order, e.g. strokes the server dropped for a slow connection."""
+        if self.order is not None and order != self.order + 1:
+            self.order_gaps += 1
+        self.order = order
+
+    def handle_control(self, message):
+        """React to server control messages on the receiver thread."""
+        kind = message["type"]
+        if kind == "welcome":
+            self.codec = message["codec"]
+        elif kind == "boards":
+            self.boards_signal.emit(message["boards"])
+        elif kind == "joined":
+            self.order = message.get("seq")  # None until the board's owner has told us where it stands
+            self.inbox.put_control(message)  # ordered with the history that follows it
+        elif kind == "pong":
+            self.rtt = time.monotonic() - message["time"]
+
     def mousePressEvent(self, event):
         if event.button() == Qt.MouseButton.LeftButton:
             self.drawing = True
-            self.last_point = event.position()
+            self.last_point = self.canvas_point(event)
 
     def mouseMoveEvent(self, event):
         if self.drawing and event.buttons() == Qt.MouseButton.LeftButton:
-            current_point = event.position()
-
-            if self.brush_settings["mode"] == "line":
-                self.draw_line(self.last_point, current_point, self.pen_color)
-
-            elif self.brush_settings["mode"] == "spray":
-                self.draw_spray(event)
-
-            data = {
-                "last_point_x": self.last_point.x(),
-                "last_point_y": self.last_point.y(),
-                "current_point_x": current_point.x(),
-                "current_point_y": current_point.y(),
-                "pen_color": self.pen_color.rgb()
-            }
-
-            try:
-                self.client_socket.sendall(json.dumps(data).encode())
-            except Exception as e:
-                print(f"Error sending data: {e}")
+            current_point = self.canvas_point(event)
+            pen_state = self.current_pen_state()
+
+            if self.brush_settings["mode"] == "spray":
+                data = self.draw_spray(current_point)
+            else:
+                data = {
+                    "last_point_x": self.last_point.x(),
+                    "last_point_y": self.last_point.y(),
+                    "current_point_x": current_point.x(),
+                    "current_point_y": current_point.y(),
+                    **pen_state
+                }
+                self.draw_local(data)
+
+            if not self.flush_timer.isActive():
+                self.flush_timer.start()
 
             self.last_point = current_point
 
+    def canvas_point(self, event):
+        """Board coordinates under the mouse for a window event."""
+        return self.canvas.to_board(self.canvas.mapFrom(self, event.position().toPoint()))
+
     def mouseReleaseEvent(self, event):
         if event.button() == Qt.MouseButton.LeftButton:
             self.drawing = False
+            self.flush_segments()
+
+    def flush_segments(self):
+        """Send every segment drawn since the last flush as one frame."""
+        self.flush_timer.stop()
+        batch = self.echo.flush()
+        if batch is None:
+            return
+        sequence, segments = batch
+        try:
+            try:
+                frame = encode_segments(segments, self.codec, sequence)
+            except ValueError:  # a jump too long for a binary run; JSON has no such limit
+                frame = encode_segments(segments, JSON_CODEC, sequence)
+            self.client_socket.sendall(frame)
+        except Exception as e:
+            print(f"Error sending data: {e}")
+
+    def send_ping(self):
+        """Time a round trip to the server; the pong is handled on the receiver thread."""
+        try:
+            self.client_socket.sendall(encode_message({"type": "ping", "time": time.monotonic()}))
+        except Exception as e:
+            print(f"Error sending data: {e}")
 
     def save_image(self):
         file_path, _ = QFileDialog.getSaveFileName(self, "Save Image", "", "PNG Files (*.png);;All Files (*)")
         if file_path:
-            self.pixmap.save(file_path, "PNG")
+            snapshot = self.canvas.board.snapshot()
+            self.show_export_status(f"Exporting {self.board}...")
+            threading.Thread(target=self.export_image, args=(snapshot, file_path)).start()
+
+    def export_image(self, snapshot, file_path):
+        """Encode a board snapshot to PNG on a worker thread."""
+        started = time.perf_counter()
+        try:
+            write_png(snapshot, file_path)
+        except OSError as e:
+            self.export_signal.emit(f"Export failed: {e}")
+            return
+        self.export_signal.emit(f"Saved {snapshot.rect.width()}x{snapshot.rect.height()} image "
+                                f"in {time.perf_counter() - started:.1f} s")
 
     def choose_color(self):
         color = QColorDialog.getColor(initial=self.pen_color, parent=self, title="Select Pen Color")
         if color.isValid():
             self.pen_color = color
 
-    def draw_spray(self, e):
-        painter = QPainter(self.pixmap)
-        p = painter.pen()
-        p.setWidth(1)
-        p.setColor(self.pen_color)
-        painter.setPen(p)
-
-        for n in range(self.brush_settings["density"]):
-            xo = random.gauss(0, self.brush_settings["diameter"])
-            yo = random.gauss(0, self.brush_settings["diameter"])
-            painter.drawPoint(
-                int(e.position().x() + xo),
-                int(e.position().y() + yo)
-            )
-
-        painter.end()
-        self.canvas.setPixmap(self.pixmap)
-
-    def draw_line(self, start, end, color):
-        """Draw a line on the local canvas."""
-        painter = QPainter(self.pixmap)
+    def draw_spray(self, center):
+        """Spray around center and return the entry that lets peers reproduce the same dots."""
+        spray = {"spray_seed": random.randrange(SPRAY_PATTERNS), "x": center.x(), "y": center.y(),
+                 "diameter": self.brush_settings["diameter"], "density": self.brush_settings["density"],
+                 "pen_color": self.pen_color.rgba()}
+        self.draw_local(spray)
+        return spray
+
+    def current_pen_state(self):
+        """Pen fields sent with every segment so peers draw it exactly as we do."""
+        color = QColor(self.pen_color)
         color.setAlphaF(self.brush_settings["opacity"]/100)
-        pen = QPen(color, self.brush_settings["width"], self.brush_settings["dashed"], self.brush_settings["cap_type"], Qt.PenJoinStyle.RoundJoin)
-        painter.setPen(pen)
-        painter.drawLine(start, end)
-        painter.end()
-        self.canvas.setPixmap(self.pixmap)
+        return {"pen_color": color.rgba(), "pen_width": self.brush_settings["width"],
+                "pen_style": "dash" if self.brush_settings["dashed"] == Qt.PenStyle.DashLine else "solid",
+                "pen_cap": "square" if self.brush_settings["cap_type"] == Qt.PenCapStyle.SquareCap else "round"}
 
     def open_brushes_dialog(self):
         dlg = CustomDialog(self.brush_settings)
@@ -254,8 +564,45 @@ class WhiteboardClient(QMainWindow):
         self.brush_settings = event
 
     def open_boards_dialog(self):
-        boards_dialog = BoardsDialog()
+        self.update_thumbnail()
+        boards_dialog = BoardsDialog(self.board, {board: thumbnail.image()
+                                                  for board, thumbnail in self.thumbnails.items()})
+        self.boards_signal.connect(boards_dialog.set_boards)
+        boards_dialog.board_selected.connect(self.switch_board)
+        try:
+            self.client_socket.sendall(encode_message({"type": "list_boards"}))
+        except Exception as e:
+            print(f"Error sending data: {e}")
         boards_dialog.exec()
+        self.boards_signal.disconnect(boards_dialog.set_boards)
+
+    def switch_board(self, board):
+        """Ask the server to move us to another board."""
+        if board == self.board:
+            return
+        self.flush_segments()
+        try:
+            self.client_socket.sendall(encode_message({"type": "join", "board": board}))
+        except Exception as e:
+            print(f"Error sending data: {e}")
+
+    def on_board_joined(self, board):
+        """Start from a blank canvas; the server follows up with the board's history.
+
+        Rejoining the same board (the server resyncing us) keeps the strokes we
+        drew that it has yet to acknowledge; they may come after the history.
+        """
+        self.update_thumbnail()  # final preview of the board we are leaving
+        if board != self.board:
+            self.echo.clear()
+        self.board = board
+        self.thumbnails[board] = BoardThumbnail()  # rebuilt as the history replays
+        self.setWindowTitle(f"Whiteboard Client - {board}")
+        self.strokes.clear()
+        self.canvas.clear()
+        local = self.echo.segments()
+        if local:
+            self.canvas.paint([(bounds, partial(draw_group, members)) for _, members, bounds in batch_by_pen(local)])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,77 @@
+"""The client's own strokes between drawing them and learning their place in the board's order.
+
+Strokes are painted the moment they are drawn, with no round trip in between,
+and sent in numbered batches. The server relays every batch in one order per
+board and acknowledges each sender's batches with that order instead of
+echoing them. Everything the client receives before the ack for a batch was
+ordered ahead of it, so pending strokes always belong on top: where a remote
+stroke lands on them, the client redraws that region from its retained
+strokes and puts the pending ones back above. An ack retires its batch and
+every earlier one (acks are cumulative, so a lost one is made good by the
+next), after which the strokes join the retained ones in the board's order.
+"""
+import time
+from collections import OrderedDict, deque
+
+from inbox import LATENCY_SAMPLES, _intersects, _unite, segment_bounds
+
+
+class LocalEcho:
+    def __init__(self):
+        self.drawing = []  # segments drawn since the last flush
+        self.drawing_bounds = None
+        self.batches = OrderedDict()  # sequence -> (segments, bounds, monotonic time sent)
+        self.next_sequence = 1
+        self.ack_times = deque(maxlen=LATENCY_SAMPLES)  # seconds from sending a batch to its ack
+        self.reconciled = 0
+
+    def draw(self, segment):
+        self.drawing.append(segment)
+        self.drawing_bounds = _unite(self.drawing_bounds, segment_bounds(segment))
+
+    def flush(self):
+        """Number the segments drawn since the last flush; (sequence, segments), or None if there are none."""
+        if not self.drawing:
+            return None
+        sequence = self.next_sequence
+        self.next_sequence += 1
+        segments = self.drawing
+        self.batches[sequence] = (segments, self.drawing_bounds, time.monotonic())
+        self.drawing = []
+        self.drawing_bounds = None
+        return sequence, segments
+
+    def ack(self, sequence):
+        """Retire the batches up to sequence; returns their segments, oldest first."""
+        now = time.monotonic()
+        acked = []
+        while self.batches and next(iter(self.batches)) <= sequence:
+            number, (segments, _, sent) = self.batches.popitem(last=False)
+            acked.extend(segments)
+            if number == sequence:
+                self.ack_times.append(now - sent)
+        return acked
+
+    def overlaps(self, bounds):
+        """Whether a board rectangle touches any stroke still waiting for its place in the order."""
+        if self.drawing_bounds is not None and _intersects(bounds, self.drawing_bounds):
+            return True
+        return any(_intersects(bounds, batch_bounds) for _, batch_bounds, _ in self.batches.values())
+
+    def segments(self):
+        """Every pending segment in drawing order."""
+        pending = [segment for segments, _, _ in self.batches.values() for segment in segments]
+        return pending + self.drawing
+
+    def clear(self):
+        self.drawing = []
+        self.drawing_bounds = None
+        self.batches.clear()
+
+    def stats(self):
+        times = sorted(self.ack_times)
+        return {
+            "unacked": len(self.batches),
+            "ack_p50_ms": 1000 * times[len(times) // 2] if times else 0.0,
+            "reconciled": self.reconciled,
+        }
@@ -0,0 +1,85 @@
+"""Board export and previews that stay off the GUI thread's critical path.
+
+write_png encodes a BoardSnapshot one row of tiles at a time, streaming the
+compressed rows straight into the file, so a huge board never has to be
+flattened into one image and the GUI keeps drawing while a worker thread
+encodes. BoardThumbnail keeps a small preview of a board current by rescaling
+only the tiles drawn on since its last update.
+"""
+import struct
+import zlib
+
+from PyQt6.QtCore import QSize, Qt
+from PyQt6.QtGui import QImage, QPainter
+
+from canvas import TILE_FORMAT
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_COMPRESSION = 6
+THUMBNAIL_SIZE = QSize(160, 120)
+THUMBNAIL_CELL = 16  # preview pixels per tile side before the mosaic is fitted to THUMBNAIL_SIZE
+
+
+def write_chunk(file, kind, data):
+    file.write(struct.pack("!I", len(data)) + kind + data + struct.pack("!I", zlib.crc32(kind + data)))
+
+
+def png_rows(band):
+    """Scanlines of an image as PNG filter-less RGB rows."""
+    image = band.convertToFormat(QImage.Format.Format_RGB888)
+    stride = image.bytesPerLine()
+    width = image.width() * 3
+    data = image.constBits().asstring(image.sizeInBytes())
+    return b"".join(b"\0" + data[offset:offset + width] for offset in range(0, stride * image.height(), stride))
+
+
+def write_png(snapshot, file_path, level=PNG_COMPRESSION):
+    """Encode a BoardSnapshot as an opaque RGB PNG; safe to run on a worker thread."""
+    rect = snapshot.rect
+    compressor = zlib.compressobj(level)
+    with open(file_path, "wb") as file:
+        file.write(PNG_SIGNATURE)
+        write_chunk(file, b"IHDR", struct.pack("!IIBBBBB", rect.width(), rect.height(), 8, 2, 0, 0, 0))
+        for band in snapshot.bands():
+            data = compressor.compress(png_rows(band))
+            if data:
+                write_chunk(file, b"IDAT", data)
+        write_chunk(file, b"IDAT", compressor.flush())
+        write_chunk(file, b"IEND", b"")
+
+
+class BoardThumbnail:
+    """Preview of one board, built from a small downscaled cell per tile."""
+
+    def __init__(self):
+        self.cells = {}  # (tx, ty) -> THUMBNAIL_CELL square copy of that tile
+        self._image = None
+
+    def update(self, board):
+        """Rescale the tiles of a TiledCanvas drawn on since the last update."""
+        dirty = board.take_dirty()
+        for key in dirty:
+            tile = board.peek(key)
+            if tile is not None:
+                self.cells[key] = tile.scaled(THUMBNAIL_CELL, THUMBNAIL_CELL, Qt.AspectRatioMode.IgnoreAspectRatio,
+                                              Qt.TransformationMode.SmoothTransformation)
+        if dirty:
+            self._image = None
+
+    def image(self):
+        """The preview, fitted within THUMBNAIL_SIZE; None while the board is blank."""
+        if self._image is None and self.cells:
+            xs = [tx for tx, _ in self.cells]
+            ys = [ty for _, ty in self.cells]
+            left, top = min(xs), min(ys)
+            mosaic = QImage((max(xs) - left + 1) * THUMBNAIL_CELL, (max(ys) - top + 1) * THUMBNAIL_CELL, TILE_FORMAT)
+            mosaic.fill(Qt.GlobalColor.white)
+            painter = QPainter(mosaic)
+            for (tx, ty), cell in self.cells.items():
+                painter.drawImage((tx - left) * THUMBNAIL_CELL, (ty - top) * THUMBNAIL_CELL, cell)
+            painter.end()
+            if mosaic.width() > THUMBNAIL_SIZE.width() or mosaic.height() > THUMBNAIL_SIZE.height():
+                mosaic = mosaic.scaled(THUMBNAIL_SIZE, Qt.AspectRatioMode.KeepAspectRatio,
+                                       Qt.TransformationMode.SmoothTransformation)
+            self._image = mosaic
+        return self._image
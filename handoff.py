@@ -0,0 +1,49 @@
+"""Passing accepted client connections between worker processes.
+
+Workers share the listening port through SO_REUSEPORT, so the kernel decides
+which one accepts a client before its hello names a board. A worker whose
+client asks for a board owned by another worker sends the connection's file
+descriptor, together with the bytes already read from it, over that worker's
+Unix socket; the owner then serves the client as if it had accepted it.
+"""
+import os
+import socket
+
+from protocol import RECV_SIZE
+
+
+def handoff_path(directory, worker):
+    return os.path.join(directory, f"{worker}.handoff")
+
+
+def listen_for_handoffs(path):
+    if os.path.exists(path):
+        os.unlink(path)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen()
+    return listener
+
+
+def send_connection(path, fileno, data):
+    """Pass a connection and its unread bytes to the worker listening on path; raises OSError on failure."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as channel:
+        channel.connect(path)
+        socket.send_fds(channel, [b"\0"], [fileno])
+        channel.sendall(data)
+
+
+def receive_connections(listener, adopt):
+    """Call adopt(connection, data) for every connection handed to this worker; runs forever."""
+    while True:
+        channel, _ = listener.accept()
+        with channel:
+            _, fds, _, _ = socket.recv_fds(channel, 1, 1)
+            chunks = []
+            while True:
+                chunk = channel.recv(RECV_SIZE)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        if fds:
+            adopt(socket.socket(fileno=fds[0]), b"".join(chunks))
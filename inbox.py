@@ -0,0 +1,167 @@
+"""Bounded hand-off of remote drawing messages from the receiver thread to the GUI.
+
+The receiver thread puts decoded segments in; the GUI drains them in batches on
+a timer tick and paints each batch with one painter. When the GUI falls behind
+the inbox applies its overflow policy instead of growing without bound:
+
+* block: the receiver thread waits for room, which stops it reading the socket
+  and lets TCP flow control push back on the server.
+* drop_oldest: the oldest queued segment is discarded.
+* merge: an incoming segment that continues the newest queued one with the same
+  pen is folded into it; otherwise the oldest segment is discarded.
+"""
+import threading
+import time
+from collections import deque
+
+from protocol import SPRAY_REACH, is_spray
+
+BLOCK = "block"
+DROP_OLDEST = "drop_oldest"
+MERGE = "merge"
+OVERFLOW_POLICIES = (BLOCK, DROP_OLDEST, MERGE)
+
+DEFAULT_CAPACITY = 20000
+LATENCY_SAMPLES = 256
+
+
+def pen_key(segment):
+    if is_spray(segment):
+        return ("spray", segment["pen_color"])
+    return (segment["pen_color"], segment["pen_width"], segment["pen_style"], segment["pen_cap"])
+
+
+def segment_bounds(segment):
+    """(left, top, right, bottom) of a segment including half its pen width, or of a spray's dots."""
+    if is_spray(segment):
+        reach = SPRAY_REACH * segment["diameter"] + 1
+        return segment["x"] - reach, segment["y"] - reach, segment["x"] + reach, segment["y"] + reach
+    margin = segment["pen_width"] // 2 + 2
+    x1, y1 = segment["last_point_x"], segment["last_point_y"]
+    x2, y2 = segment["current_point_x"], segment["current_point_y"]
+    return min(x1, x2) - margin, min(y1, y2) - margin, max(x1, x2) + margin, max(y1, y2) + margin
+
+
+def _unite(a, b):
+    if a is None:
+        return b
+    return min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])
+
+
+def _intersects(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def batch_by_pen(segments):
+    """Group segments by pen so each group can be drawn with a single setPen.
+
+    A segment joins the latest group with its pen only if it does not overlap
+    any group drawn after that one, so reordering never changes which stroke
+    ends up on top. Returns a list of (pen key, segments, bounds).
+    """
+    groups = []
+    latest = {}  # pen key -> index of its newest group
+    for segment in segments:
+        key = pen_key(segment)
+        bounds = segment_bounds(segment)
+        index = latest.get(key)
+        if index is not None and not any(_intersects(bounds, group[2]) for group in groups[index + 1:]):
+            _, members, group_bounds = groups[index]
+            members.append(segment)
+            groups[index] = (key, members, _unite(group_bounds, bounds))
+        else:
+            latest[key] = len(groups)
+            groups.append((key, [segment], bounds))
+    return groups
+
+
+class StrokeInbox:
+    def __init__(self, capacity=DEFAULT_CAPACITY, policy=BLOCK):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {policy!r}")
+        self.capacity = capacity
+        self.policy = policy
+        self._cond = threading.Condition()
+        self._items = deque()  # (arrival time, message)
+        self.peak_depth = 0
+        self.dropped = 0
+        self.merged = 0
+        self.paint_latencies = deque(maxlen=LATENCY_SAMPLES)  # seconds from arrival to painted
+        self.paint_times = deque(maxlen=LATENCY_SAMPLES)  # seconds spent painting one batch
+
+    def put(self, segments):
+        """Queue segments from the receiver thread, applying the overflow policy when full."""
+        now = time.monotonic()
+        with self._cond:
+            for segment in segments:
+                if len(self._items) >= self.capacity:
+                    if self.policy == BLOCK:
+                        self._cond.wait_for(lambda: len(self._items) < self.capacity)
+                    elif self.policy == MERGE and self._merge_into_newest(segment):
+                        continue
+                    else:
+                        self._drop_oldest()
+                self._items.append((now, segment))
+            self.peak_depth = max(self.peak_depth, len(self._items))
+
+    def _drop_oldest(self):
+        """Discard the oldest segment, keeping canvas resets and acks queued ahead of it."""
+        for index, (_, message) in enumerate(self._items):
+            if "type" not in message:
+                del self._items[index]
+                self.dropped += 1
+                return
+
+    def _merge_into_newest(self, segment):
+        _, newest = self._items[-1]
+        if ("type" not in newest and not is_spray(segment) and pen_key(newest) == pen_key(segment)
+                and (newest["current_point_x"], newest["current_point_y"])
+                == (segment["last_point_x"], segment["last_point_y"])):
+            newest["current_point_x"] = segment["current_point_x"]
+            newest["current_point_y"] = segment["current_point_y"]
+            self.merged += 1
+            return True
+        return False
+
+    def put_ordered(self, message):
+        """Queue a message that must be applied in order with the segments around it, e.g. an ack."""
+        with self._cond:
+            self._items.append((time.monotonic(), message))
+
+    def put_control(self, message):
+        """Queue a message that resets the canvas; anything queued before it is obsolete except acks.
+
+        Acks still have to retire our own batches: the history that follows
+        the reset already contains their strokes.
+        """
+        with self._cond:
+            acks = [item for item in self._items if item[1].get("type") == "ack"]
+            self.dropped += len(self._items) - len(acks)
+            self._items = deque(acks)
+            self._items.append((time.monotonic(), message))
+            self._cond.notify_all()
+
+    def drain(self, limit):
+        """Take up to limit queued (arrival time, message) items, oldest first."""
+        with self._cond:
+            count = min(limit, len(self._items))
+            items = [self._items.popleft() for _ in range(count)]
+            if items:
+                self._cond.notify_all()
+            return items
+
+    def record_paint(self, latency, paint_time):
+        self.paint_latencies.append(latency)
+        self.paint_times.append(paint_time)
+
+    def stats(self):
+        latencies = sorted(self.paint_latencies)
+        return {
+            "depth": len(self._items),
+            "peak_depth": self.peak_depth,
+            "dropped": self.dropped,
+            "merged": self.merged,
+            "latency_p50_ms": 1000 * latencies[len(latencies) // 2] if latencies else 0.0,
+            "latency_p99_ms": 1000 * latencies[int(len(latencies) * 0.99)] if latencies else 0.0,
+            "paint_ms": 1000 * sum(self.paint_times) / len(self.paint_times) if self.paint_times else 0.0,
+        }
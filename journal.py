@@ -0,0 +1,234 @@
+"""Durable, append-only journal of the stroke payloads relayed by the server.
+
+Each record is one frame (see protocol.encode_frame) whose body is the board
+name, prefixed by its 2-byte length, followed by the payload exactly as it was
+relayed. Appends are only queued; a writer thread flushes whatever accumulated
+with a single write and fsync (group commit), so the broadcast path never
+waits on the disk.
+
+Next to the journal, PATH.snapshot holds a checkpoint of every board: its
+compacted snapshot chunks, the payloads not folded yet, and the journal offset
+from which the board's records are newer than the checkpoint. A checkpoint is
+written to a temporary file and renamed over the previous one, and only once
+the journal is committed up to its offsets, so the pair on disk is always
+consistent.
+
+On startup both files are memory-mapped and records are handed out as
+memoryview slices of the mappings, so rebuilding the boards copies no payload
+bytes, and only the journal records after the checkpoint are walked.
+"""
+import mmap
+import os
+import struct
+import threading
+import time
+
+from protocol import FRAME_HEADER
+
+BOARD_HEADER = struct.Struct("!H")
+GROUP_COMMIT_INTERVAL = 0.05  # seconds a commit waits for more records to share its fsync
+CHECKPOINT_MIN_BYTES = 64 * 1024 * 1024  # journal growth that makes a checkpoint worth writing
+CHECKPOINT_POLL_INTERVAL = 5.0  # seconds between checks whether a checkpoint is due
+SNAPSHOT_MAGIC = b"WBS1"
+SNAPSHOT_HEADER = struct.Struct("!4sQI")  # magic, journal offset before any board was captured, board count
+BOARD_SNAPSHOT = struct.Struct("!QQII")  # journal offset, board order, snapshot chunks, unfolded payloads
+
+
+class BoardCheckpoint:
+    """One board's history as of a journal offset: chunks already compacted and payloads still to fold."""
+
+    def __init__(self, board, offset, sequence, chunks, pending):
+        self.board = board
+        self.offset = offset
+        self.sequence = sequence
+        self.chunks = chunks
+        self.pending = pending
+
+
+def _map(path):
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return None
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _read_frames(view, offset, count):
+    """count frame payloads starting at offset, and the offset after them."""
+    payloads = []
+    for _ in range(count):
+        (length,) = FRAME_HEADER.unpack_from(view, offset)
+        start = offset + FRAME_HEADER.size
+        offset = start + length
+        if offset > len(view):
+            raise ValueError("Snapshot frame runs past the end of the file")
+        payloads.append(view[start:offset])
+    return payloads, offset
+
+
+class StrokeJournal:
+    def __init__(self, path, commit_interval=GROUP_COMMIT_INTERVAL, checkpoint_bytes=CHECKPOINT_MIN_BYTES):
+        self.path = path
+        self.snapshot_path = f"{path}.snapshot"
+        self.commit_interval = commit_interval
+        self.checkpoint_bytes = checkpoint_bytes
+        self.mapping = None  # kept open for as long as replayed payload views are in use
+        self.snapshot_mapping = None
+        self.valid_size = None  # end of the last complete record, known once replay() has run
+        self.appended_size = 0  # journal size once every queued record is written
+        self.committed_size = 0  # journal size written and fsynced
+        self.checkpoint_offset = 0  # journal offset of the newest checkpoint on disk
+        self.snapshot_size = 0
+        self._cond = threading.Condition()
+        self._pending = []
+        self._closed = False
+        self._file = None
+        self._writer = None
+
+    def load_snapshot(self):
+        """(journal offset, [BoardCheckpoint]) of the newest checkpoint, or None if there is no usable one."""
+        mapping = _map(self.snapshot_path)
+        if mapping is None:
+            return None
+        view = memoryview(mapping)
+        journal_size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        try:
+            magic, start, board_count = SNAPSHOT_HEADER.unpack_from(view, 0)
+            if magic != SNAPSHOT_MAGIC:
+                raise ValueError(f"unknown format {bytes(magic)!r}")
+            if start > journal_size:
+                raise ValueError(f"it starts at byte {start} of a {journal_size} byte journal")
+            offset = SNAPSHOT_HEADER.size
+            boards = []
+            for _ in range(board_count):
+                board_offset, sequence, chunk_count, pending_count = BOARD_SNAPSHOT.unpack_from(view, offset)
+                offset += BOARD_SNAPSHOT.size
+                (name_length,) = BOARD_HEADER.unpack_from(view, offset)
+                offset += BOARD_HEADER.size
+                name = bytes(view[offset:offset + name_length]).decode()
+                offset += name_length
+                chunks, offset = _read_frames(view, offset, chunk_count)
+                pending, offset = _read_frames(view, offset, pending_count)
+                boards.append(BoardCheckpoint(name, board_offset, sequence, chunks, pending))
+        except (struct.error, ValueError) as e:
+            print(f"Ignoring unreadable journal snapshot {self.snapshot_path}: {e}")
+            return None
+        self.snapshot_mapping = mapping
+        self.checkpoint_offset = start
+        self.snapshot_size = len(mapping)
+        return start, boards
+
+    def replay(self, start=0):
+        """Yield (offset, board, payload) for every complete record on disk from offset start on.
+
+        A record cut short by a crash ends the replay; start() truncates it away.
+        """
+        self.valid_size = start
+        self.mapping = _map(self.path)
+        if self.mapping is None:
+            return
+        view = memoryview(self.mapping)
+        size = len(view)
+        boards = {}  # raw name -> decoded name, most journals hold few distinct boards
+        offset = start
+        while offset + FRAME_HEADER.size <= size:
+            (length,) = FRAME_HEADER.unpack_from(view, offset)
+            body = offset + FRAME_HEADER.size
+            end = body + length
+            if end > size or length < BOARD_HEADER.size:
+                break
+            (name_length,) = BOARD_HEADER.unpack_from(view, body)
+            name_start = body + BOARD_HEADER.size
+            name_end = name_start + name_length
+            if name_end > end:
+                break
+            raw_name = self.mapping[name_start:name_end]
+            board = boards.get(raw_name)
+            if board is None:
+                board = boards[raw_name] = raw_name.decode()
+            yield offset, board, view[name_end:end]
+            offset = end
+            self.valid_size = offset
+
+    def start(self):
+        """Open the journal for appending and start the group-commit writer."""
+        if self.valid_size is None:
+            for _ in self.replay():
+                pass
+        if os.path.exists(self.path) and os.path.getsize(self.path) > self.valid_size:
+            print(f"Truncating torn journal tail at byte {self.valid_size}")
+            os.truncate(self.path, self.valid_size)
+        self.appended_size = self.committed_size = self.valid_size
+        self._file = open(self.path, "ab")
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    def append(self, board, payload):
+        """Queue a record; callers hold the board's lock, so a board's records keep its order."""
+        name = board.encode()
+        header = FRAME_HEADER.pack(BOARD_HEADER.size + len(name) + len(payload)) + BOARD_HEADER.pack(len(name))
+        with self._cond:
+            self._pending.extend((header, name, payload))
+            self.appended_size += len(header) + len(name) + len(payload)
+            self._cond.notify()
+
+    def _write_loop(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                batch, self._pending = self._pending, []
+                closed = self._closed
+            if batch:
+                data = b"".join(batch)
+                self._file.write(data)
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                with self._cond:
+                    self.committed_size += len(data)
+                    self._cond.notify_all()
+            elif closed:
+                return
+            time.sleep(self.commit_interval)
+
+    def checkpoint_due(self):
+        """Whether the journal grew by checkpoint_bytes since the last checkpoint, or by its size if larger.
+
+        Tying the interval to the snapshot's size keeps the cost of rewriting it
+        at most that of the journal writes in between.
+        """
+        return self.appended_size - self.checkpoint_offset >= max(self.checkpoint_bytes, self.snapshot_size)
+
+    def write_snapshot(self, start, checkpoints):
+        """Replace the snapshot with checkpoints, once the journal is committed up to their offsets."""
+        end = max([start] + [checkpoint.offset for checkpoint in checkpoints])
+        with self._cond:
+            self._cond.wait_for(lambda: self.committed_size >= end or self._closed)
+            if self.committed_size < end:
+                return False
+        temporary = f"{self.snapshot_path}.tmp"
+        size = 0
+        with open(temporary, "wb") as f:
+            f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, start, len(checkpoints)))
+            for checkpoint in checkpoints:
+                name = checkpoint.board.encode()
+                f.write(BOARD_SNAPSHOT.pack(checkpoint.offset, checkpoint.sequence, len(checkpoint.chunks),
+                                            len(checkpoint.pending)) + BOARD_HEADER.pack(len(name)) + name)
+                for payload in checkpoint.chunks + checkpoint.pending:
+                    f.write(FRAME_HEADER.pack(len(payload)))
+                    f.write(payload)
+            size = f.tell()
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.snapshot_path)
+        self.checkpoint_offset = start
+        self.snapshot_size = size
+        return True
+
+    def close(self):
+        """Commit everything appended so far and stop the writer."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._writer is not None:
+            self._writer.join()
+            self._file.close()
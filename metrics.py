@@ -0,0 +1,222 @@
+"""Server instrumentation: counters, latency histograms, a stats endpoint and a sampling profiler.
+
+Hot paths only bump counters and drop durations into fixed power-of-two
+buckets, so recording costs a lock round-trip and no allocation. Snapshots add
+per-second rates since the same consumer's previous snapshot (the endpoint and
+the periodic dump each keep their own) and whatever gauges the server reports
+(queue depths, members per board) at that moment.
+
+StatsServer publishes snapshots over plain HTTP on a local port:
+
+* GET /stats: the current snapshot as JSON.
+* POST /profile/start?interval=MS, POST /profile/stop: switch the sampling
+  profiler on or off without restarting; intervals are clamped between
+  PROFILE_MIN_INTERVAL and PROFILE_MAX_INTERVAL.
+* GET /profile: the most sampled stacks (collapsed, root first) and functions.
+"""
+import json
+import math
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+HISTOGRAM_BUCKETS = 32  # bucket i counts durations below 2**i microseconds
+PROFILE_INTERVAL = 0.005
+PROFILE_MIN_INTERVAL = 0.001  # sampling any faster would starve the threads being sampled
+PROFILE_MAX_INTERVAL = 1.0  # sampling any slower collects too few samples to rank anything
+PROFILE_DEPTH = 64
+PROFILE_TOP = 40
+
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * HISTOGRAM_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.buckets[min(HISTOGRAM_BUCKETS - 1, int(seconds * 1e6).bit_length())] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        """Upper bound, in milliseconds, of the bucket holding the q-th duration."""
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank and count:
+                return (1 << index) / 1000
+        return 0.0
+
+    def snapshot(self):
+        if not self.count:
+            return {"count": 0}
+        return {"count": self.count, "mean_ms": round(1000 * self.total / self.count, 3),
+                "p50_ms": self.quantile(0.5), "p99_ms": self.quantile(0.99), "p999_ms": self.quantile(0.999),
+                "max_ms": round(1000 * self.max, 3)}
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.counters = defaultdict(int)
+        self.histograms = defaultdict(Histogram)
+        self.boards = defaultdict(lambda: [0, 0])  # board -> [payloads, bytes]
+        self._previous = {}  # consumer -> (monotonic time, counters) of its previous snapshot
+        self._started_monotonic = time.monotonic()
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def observe(self, name, seconds):
+        with self._lock:
+            self.histograms[name].record(seconds)
+
+    def count_board(self, board, size):
+        with self._lock:
+            totals = self.boards[board]
+            totals[0] += 1
+            totals[1] += size
+
+    def snapshot(self, consumer=None):
+        """Counters, their per-second rates since consumer's previous snapshot, histograms and per-board totals."""
+        now = time.monotonic()
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = {name: histogram.snapshot() for name, histogram in self.histograms.items()}
+            boards = {board: {"payloads": payloads, "bytes": size} for board, (payloads, size) in self.boards.items()}
+            previous_time, previous = self._previous.get(consumer, (self._started_monotonic, {}))
+            self._previous[consumer] = (now, counters)
+        elapsed = now - previous_time
+        rates = {}
+        if elapsed > 0:
+            rates = {name: round((value - previous.get(name, 0)) / elapsed, 1) for name, value in counters.items()}
+        return {"uptime_s": round(time.time() - self.started, 1), "interval_s": round(elapsed, 3),
+                "counters": counters, "rates": rates, "histograms": histograms, "boards": boards}
+
+
+class SamplingProfiler:
+    """Samples every thread's stack at a fixed interval while switched on."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = None  # set to wake the running sampler and end it
+        self._running = False
+        self.interval = PROFILE_INTERVAL
+        self.samples = 0
+        self.stacks = Counter()
+        self.functions = Counter()
+
+    def start(self, interval=PROFILE_INTERVAL):
+        """Start sampling from scratch; returns False if already running."""
+        with self._lock:
+            if self._running:
+                return False
+            self._running = True
+            self.interval = interval
+            self.samples = 0
+            self.stacks.clear()
+            self.functions.clear()
+            self._stopped = threading.Event()
+            self._thread = threading.Thread(target=self._sample_loop, args=(interval, self._stopped), daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        """Stop sampling and wait for the sampler, waking it if it is between samples."""
+        with self._lock:
+            self._running = False
+            thread = self._thread
+            if self._stopped is not None:
+                self._stopped.set()
+        if thread is not None:
+            thread.join()
+
+    def _sample_loop(self, interval, stopped):
+        own = threading.get_ident()
+        while not stopped.is_set():
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                names = []
+                while frame is not None and len(names) < PROFILE_DEPTH:
+                    code = frame.f_code
+                    names.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}")
+                    frame = frame.f_back
+                with self._lock:
+                    self.stacks[";".join(reversed(names))] += 1
+                    self.functions[names[0]] += 1
+            with self._lock:
+                self.samples += 1
+            stopped.wait(interval)
+
+    def report(self, limit=PROFILE_TOP):
+        with self._lock:
+            return {"running": self._running, "interval_ms": 1000 * self.interval, "samples": self.samples,
+                    "functions": [{"function": name, "samples": count}
+                                  for name, count in self.functions.most_common(limit)],
+                    "stacks": [{"stack": stack, "samples": count} for stack, count in self.stacks.most_common(limit)]}
+
+
+class StatsServer(ThreadingHTTPServer):
+    """Local HTTP endpoint serving snapshots from stats() and controlling a SamplingProfiler."""
+
+    daemon_threads = True
+
+    def __init__(self, port, stats, profiler, host="127.0.0.1"):
+        super().__init__((host, port), StatsHandler)
+        self.stats = stats
+        self.profiler = profiler
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        print(f"Stats endpoint on http://{self.server_address[0]}:{self.server_address[1]}/stats")
+
+
+class StatsHandler(BaseHTTPRequestHandler):
+    def reply(self, body, status=200):
+        data = json.dumps(body, indent=1).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/stats":
+            self.reply(self.server.stats("endpoint"))
+        elif path == "/profile":
+            self.reply(self.server.profiler.report())
+        else:
+            self.reply({"error": f"unknown path {path}"}, 404)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path == "/profile/start":
+            try:
+                interval = float(parse_qs(url.query).get("interval", [1000 * PROFILE_INTERVAL])[0]) / 1000
+            except ValueError:
+                interval = math.nan
+            if not math.isfinite(interval):
+                self.reply({"error": "interval must be a number of milliseconds"}, 400)
+                return
+            interval = min(max(interval, PROFILE_MIN_INTERVAL), PROFILE_MAX_INTERVAL)
+            self.reply({"started": self.server.profiler.start(interval)})
+        elif url.path == "/profile/stop":
+            self.server.profiler.stop()
+            self.reply(self.server.profiler.report())
+        else:
+            self.reply({"error": f"unknown path {url.path}"}, 404)
+
+    def log_message(self, format, *args):
+        pass  # keep request lines out of the server's console
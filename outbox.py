@@ -0,0 +1,112 @@
+"""Bounded per-client send buffers for the server's fan-out path.
+
+Broadcasting only appends a frame to each recipient's buffer; a writer per
+client drains it onto the socket, so a client on a slow link delays nobody but
+itself. Frames are tagged with what they carry:
+
+* control: answers to the client's own requests; always queued.
+* history: a `joined` marker and the board replay that follows it; always
+  queued, since the client rebuilds its canvas from them.
+* relay: strokes from other clients. Only these count against the capacity;
+  when one does not fit, put() refuses it and the server applies its
+  slow-consumer policy to the client.
+"""
+import asyncio
+import threading
+from collections import deque
+
+CONTROL = "control"
+HISTORY = "history"
+RELAY = "relay"
+
+SNAPSHOT = "snapshot"
+DROP = "drop"
+DISCONNECT = "disconnect"
+SLOW_CONSUMER_POLICIES = (SNAPSHOT, DROP, DISCONNECT)
+
+DEFAULT_SEND_BUFFER = 4 * 1024 * 1024  # bytes of relayed strokes queued per client
+
+
+class SendBuffer:
+    def __init__(self, capacity=DEFAULT_SEND_BUFFER):
+        self.capacity = capacity
+        self._cond = threading.Condition()
+        self._frames = deque()  # (frame, kind)
+        self.relay_bytes = 0
+        self.closed = False
+
+    def _wake(self):
+        self._cond.notify()
+
+    def put(self, frame, kind=CONTROL, force=False):
+        """Queue a frame; returns False if a relay frame does not fit and force is not set."""
+        with self._cond:
+            if self.closed:
+                return True
+            if kind == RELAY:
+                if not force and self.relay_bytes + len(frame) > self.capacity:
+                    return False
+                self.relay_bytes += len(frame)
+            self._frames.append((frame, kind))
+            self._wake()
+            return True
+
+    def make_room(self, size):
+        """Discard the oldest relay frames until size more bytes fit; returns how many were dropped."""
+        with self._cond:
+            kept = deque()
+            dropped = 0
+            for frame, kind in self._frames:
+                if kind == RELAY and self.relay_bytes + size > self.capacity:
+                    self.relay_bytes -= len(frame)
+                    dropped += 1
+                else:
+                    kept.append((frame, kind))
+            self._frames = kept
+            return dropped
+
+    def discard_board_frames(self):
+        """Drop queued strokes and history ahead of a fresh replay; returns how many were dropped."""
+        with self._cond:
+            count = len(self._frames)
+            self._frames = deque(item for item in self._frames if item[1] == CONTROL)
+            self.relay_bytes = 0
+            return count - len(self._frames)
+
+    def _take(self):
+        frames = [frame for frame, _ in self._frames] if not self.closed else []
+        self._frames.clear()
+        self.relay_bytes = 0
+        return frames
+
+    def next_batch(self):
+        """Block until frames are queued and take them all; an empty list once closed."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._frames or self.closed)
+            return self._take()
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._frames.clear()
+            self._wake()
+
+    def __len__(self):
+        return len(self._frames)
+
+
+class AsyncSendBuffer(SendBuffer):
+    """SendBuffer whose writer is a task on the event loop that fills it."""
+
+    def __init__(self, capacity=DEFAULT_SEND_BUFFER):
+        super().__init__(capacity)
+        self._ready = asyncio.Event()
+
+    def _wake(self):
+        self._ready.set()
+
+    async def next_batch(self):
+        while not self._frames and not self.closed:
+            self._ready.clear()
+            await self._ready.wait()
+        return self._take()
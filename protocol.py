@@ -0,0 +1,340 @@
+"""Wire protocol shared by the whiteboard server and client.
+
+Every message travels as a frame: a 4-byte big-endian payload length followed by
+the payload itself, so messages survive TCP splitting and coalescing intact.
+
+A payload is either JSON (control messages, or a list of stroke segments) or,
+once both ends have negotiated the binary codec, a packed stroke batch whose
+first byte is STROKES_TAG. Packed batches group consecutive segments into runs
+sharing one pen header, with int16 coordinate deltas after the first point.
+
+Besides line segments a batch may hold spray entries (dicts with a
+"spray_seed" key). They carry the centre, diameter, density and pattern seed
+rather than the dots, which every peer regenerates from the seed.
+
+Stroke payloads can travel in a sequenced envelope: SEQUENCED_TAG and a number
+in front of the payload. A client numbers its own batches; the server relays
+every batch to the other members wrapped with its place in the board's order.
+The sender gets an ack instead (ACK_TAG, the board order, its own number),
+followed by the payload only if the server rewrote it, e.g. by simplifying.
+"""
+import json
+import struct
+import sys
+from array import array
+
+FRAME_HEADER = struct.Struct("!I")
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+RECV_SIZE = 65536
+
+DEFAULT_BOARD = "default"
+MAX_BOARD_NAME = 64
+
+JSON_CODEC = "json"
+BINARY_CODEC = "binary"
+SUPPORTED_CODECS = (BINARY_CODEC, JSON_CODEC)  # in order of preference
+
+STROKES_TAG = 0x01
+SEQUENCED_TAG = 0x02
+SEQUENCED_HEADER = struct.Struct("!BQ")  # tag, client sequence (to the server) or board order (from it)
+ACK_TAG = 0x03
+ACK_HEADER = struct.Struct("!BQQ")  # tag, board order, client sequence
+STROKES_HEADER = struct.Struct("!BH")  # tag, entry count
+RUN_ENTRY = 0
+SPRAY_ENTRY = 1
+RUN_HEADER = struct.Struct("!BIBBBiiH")  # kind, rgba, width, style, cap, first x, first y, delta count
+SPRAY_RECORD = struct.Struct("!BIiiHHH")  # kind, rgba, centre x, centre y, diameter, density, seed
+PEN_STYLES = ("solid", "dash")
+PEN_CAPS = ("round", "square")
+SPRAY_PATTERNS = 64  # distinct seeds, so peers can cache every pattern they render
+SPRAY_REACH = 4  # spray dots are clamped to this many diameters from the centre
+MAX_ENTRIES = 0xFFFF
+MAX_RUN_DELTAS = 0xFFFF
+DELTA_MIN, DELTA_MAX = -0x8000, 0x7FFF
+
+
+class ProtocolError(Exception):
+    """Raised when the peer sends bytes that cannot be a valid frame."""
+
+
+def encode_frame(payload):
+    """Prefix a payload with its length."""
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+def encode_json(message):
+    return json.dumps(message, separators=(",", ":")).encode()
+
+
+def encode_message(message):
+    """Serialize a JSON-compatible message into a complete frame."""
+    return encode_frame(encode_json(message))
+
+
+def decode_message(payload):
+    if isinstance(payload, memoryview):  # e.g. a slice of the memory-mapped journal
+        payload = payload.tobytes()
+    return json.loads(payload)
+
+
+def payload_codec(payload):
+    return BINARY_CODEC if payload[:1] == bytes((STROKES_TAG,)) else JSON_CODEC
+
+
+def is_control(payload):
+    """Control messages are JSON objects; stroke batches are JSON lists or binary."""
+    return payload[:1] == b"{"
+
+
+def negotiate_codec(offered):
+    """Pick the preferred codec both sides support; JSON is always available."""
+    for codec in SUPPORTED_CODECS:
+        if codec in offered:
+            return codec
+    return JSON_CODEC
+
+
+def encode_sequenced(number, payload):
+    return SEQUENCED_HEADER.pack(SEQUENCED_TAG, number) + payload
+
+
+def is_sequenced(payload):
+    return payload[:1] == bytes((SEQUENCED_TAG,))
+
+
+def decode_sequenced(payload):
+    """(number, payload) of a sequenced envelope."""
+    _, number = SEQUENCED_HEADER.unpack_from(payload)
+    return number, payload[SEQUENCED_HEADER.size:]
+
+
+def encode_ack(order, sequence, payload=b""):
+    return ACK_HEADER.pack(ACK_TAG, order, sequence) + payload
+
+
+def is_ack(payload):
+    return payload[:1] == bytes((ACK_TAG,))
+
+
+def decode_ack(payload):
+    """(board order, client sequence, rewritten payload or b"") of an ack."""
+    _, order, sequence = ACK_HEADER.unpack_from(payload)
+    return order, sequence, payload[ACK_HEADER.size:]
+
+
+def envelope_size(payload):
+    if is_sequenced(payload):
+        return SEQUENCED_HEADER.size
+    if is_ack(payload):
+        return ACK_HEADER.size
+    return 0
+
+
+def is_spray(entry):
+    return "spray_seed" in entry
+
+
+def _pen_key(segment):
+    return (segment["pen_color"], segment["pen_width"], segment["pen_style"], segment["pen_cap"])
+
+
+def _split_entries(segments):
+    """Group line segments into polylines that share a pen and connect end to start.
+
+    Spray entries are kept as they are and end the current polyline, so the
+    batch keeps its drawing order.
+    """
+    entries = []
+    pen = points = None
+    for segment in segments:
+        if is_spray(segment):
+            entries.append((SPRAY_ENTRY, segment))
+            points = None
+            continue
+        start = (segment["last_point_x"], segment["last_point_y"])
+        end = (segment["current_point_x"], segment["current_point_y"])
+        dx, dy = end[0] - start[0], end[1] - start[1]
+        if (points is not None and _pen_key(segment) == pen and points[-1] == start
+                and len(points) <= MAX_RUN_DELTAS
+                and DELTA_MIN <= dx <= DELTA_MAX and DELTA_MIN <= dy <= DELTA_MAX):
+            points.append(end)
+        else:
+            pen = _pen_key(segment)
+            points = [start, end]
+            entries.append((RUN_ENTRY, (pen, points)))
+    return entries
+
+
+def encode_strokes(segments):
+    """Pack stroke segments and spray entries into a binary STROKES payload."""
+    entries = _split_entries(segments)
+    if len(entries) > MAX_ENTRIES:
+        raise ValueError(f"{len(entries)} entries do not fit in one binary batch")
+    parts = [STROKES_HEADER.pack(STROKES_TAG, len(entries))]
+    for kind, entry in entries:
+        if kind == SPRAY_ENTRY:
+            parts.append(SPRAY_RECORD.pack(SPRAY_ENTRY, entry["pen_color"], entry["x"], entry["y"],
+                                           entry["diameter"], entry["density"], entry["spray_seed"]))
+            continue
+        (color, width, style, cap), points = entry
+        deltas = array("h")
+        for (x0, y0), (x1, y1) in zip(points, points[1:]):
+            dx, dy = x1 - x0, y1 - y0
+            if not (DELTA_MIN <= dx <= DELTA_MAX and DELTA_MIN <= dy <= DELTA_MAX):
+                raise ValueError(f"Segment delta ({dx}, {dy}) does not fit in a run")
+            deltas.append(dx)
+            deltas.append(dy)
+        if sys.byteorder == "little":
+            deltas.byteswap()
+        x, y = points[0]
+        parts.append(RUN_HEADER.pack(RUN_ENTRY, color, width, PEN_STYLES.index(style), PEN_CAPS.index(cap),
+                                     x, y, len(points) - 1))
+        parts.append(deltas.tobytes())
+    return b"".join(parts)
+
+
+def decode_strokes(payload):
+    """Unpack a binary STROKES payload back into segment and spray dicts."""
+    view = memoryview(payload)
+    tag, entry_count = STROKES_HEADER.unpack_from(view, 0)
+    if tag != STROKES_TAG:
+        raise ProtocolError(f"Unexpected payload tag {tag}")
+    offset = STROKES_HEADER.size
+    segments = []
+    for _ in range(entry_count):
+        if view[offset] == SPRAY_ENTRY:
+            _, color, x, y, diameter, density, seed = SPRAY_RECORD.unpack_from(view, offset)
+            offset += SPRAY_RECORD.size
+            segments.append({"spray_seed": seed, "x": x, "y": y, "diameter": diameter, "density": density,
+                             "pen_color": color})
+            continue
+        _, color, width, style, cap, x, y, count = RUN_HEADER.unpack_from(view, offset)
+        offset += RUN_HEADER.size
+        deltas = array("h")
+        deltas.frombytes(view[offset:offset + 4 * count])
+        offset += 4 * count
+        if sys.byteorder == "little":
+            deltas.byteswap()
+        pen = {"pen_color": color, "pen_width": width, "pen_style": PEN_STYLES[style], "pen_cap": PEN_CAPS[cap]}
+        for i in range(0, 2 * count, 2):
+            nx, ny = x + deltas[i], y + deltas[i + 1]
+            segments.append({"last_point_x": x, "last_point_y": y, "current_point_x": nx, "current_point_y": ny,
+                             **pen})
+            x, y = nx, ny
+    return segments
+
+
+def encode_segments(segments, codec, sequence=0):
+    """Build a frame carrying stroke segments in the given codec, in a sequenced envelope if numbered."""
+    payload = encode_strokes(segments) if codec == BINARY_CODEC else encode_json(segments)
+    return encode_frame(encode_sequenced(sequence, payload) if sequence else payload)
+
+
+def decode_payload(payload):
+    """Decode a payload of either codec; binary payloads yield a list of segments."""
+    if payload_codec(payload) == BINARY_CODEC:
+        return decode_strokes(payload)
+    return decode_message(payload)
+
+
+INT32 = (-0x80000000, 0x7FFFFFFF)
+UINT32 = (0, 0xFFFFFFFF)
+UINT16 = (0, 0xFFFF)
+UINT8 = (0, 0xFF)
+LINE_FIELDS = {"last_point_x": INT32, "last_point_y": INT32, "current_point_x": INT32, "current_point_y": INT32,
+               "pen_color": UINT32, "pen_width": UINT8}
+SPRAY_FIELDS = {"x": INT32, "y": INT32, "diameter": UINT16, "density": UINT16, "spray_seed": UINT16,
+                "pen_color": UINT32}
+
+
+def check_segment(segment):
+    """Raise ProtocolError unless segment is a line segment or spray entry the binary codec could carry."""
+    if not isinstance(segment, dict):
+        raise ProtocolError(f"Stroke entry is a {type(segment).__name__}, not an object")
+    fields = SPRAY_FIELDS if is_spray(segment) else LINE_FIELDS
+    for name, (low, high) in fields.items():
+        value = segment.get(name)
+        if type(value) is not int or not low <= value <= high:
+            raise ProtocolError(f"Stroke entry has a bad {name}: {value!r}")
+    if not is_spray(segment) and (segment.get("pen_style") not in PEN_STYLES
+                                  or segment.get("pen_cap") not in PEN_CAPS):
+        raise ProtocolError(f"Stroke entry has an unknown pen style or cap: {segment!r}")
+
+
+def check_strokes(payload):
+    """Walk the entry headers of a binary STROKES payload, raising ProtocolError unless it decodes cleanly."""
+    view = memoryview(payload)
+    if len(view) < STROKES_HEADER.size:
+        raise ProtocolError("Truncated stroke batch")
+    tag, entry_count = STROKES_HEADER.unpack_from(view, 0)
+    if tag != STROKES_TAG:
+        raise ProtocolError(f"Unexpected payload tag {tag}")
+    offset = STROKES_HEADER.size
+    for _ in range(entry_count):
+        if offset >= len(view):
+            raise ProtocolError("Truncated stroke batch")
+        kind = view[offset]
+        if kind == SPRAY_ENTRY:
+            offset += SPRAY_RECORD.size
+        elif kind == RUN_ENTRY:
+            if offset + RUN_HEADER.size > len(view):
+                raise ProtocolError("Truncated stroke batch")
+            _, _, _, style, cap, _, _, count = RUN_HEADER.unpack_from(view, offset)
+            if style >= len(PEN_STYLES) or cap >= len(PEN_CAPS):
+                raise ProtocolError(f"Unknown pen style {style} or cap {cap}")
+            offset += RUN_HEADER.size + 4 * count
+        else:
+            raise ProtocolError(f"Unknown stroke entry kind {kind}")
+    if offset != len(view):
+        raise ProtocolError(f"Stroke batch of {len(view)} bytes holds {offset} bytes of entries")
+
+
+def check_stroke_payload(payload):
+    """Raise ProtocolError unless a payload is a stroke batch of either codec that every peer can decode.
+
+    Binary batches are checked without being decoded; JSON ones must be a list
+    of segments, or a single segment as the oldest clients send.
+    """
+    if payload_codec(payload) == BINARY_CODEC:
+        check_strokes(payload)
+        return
+    try:
+        message = decode_message(payload)
+    except ValueError as e:  # also covers bytes that are not UTF-8
+        raise ProtocolError(f"Payload is neither JSON nor a binary stroke batch: {e}") from None
+    if isinstance(message, dict) and "type" in message:
+        raise ProtocolError(f"Control message {message['type']!r} is not a stroke batch")
+    for segment in message if isinstance(message, list) else [message]:
+        check_segment(segment)
+
+
+def transcode_frame(payload, codec):
+    """Frame a relayed payload for a peer restricted to the given codec, keeping any envelope around it."""
+    start = envelope_size(payload)
+    if codec == BINARY_CODEC or payload_codec(payload[start:]) == JSON_CODEC:
+        return encode_frame(payload)
+    return encode_frame(b"".join((payload[:start], encode_json(decode_strokes(payload[start:])))))
+
+
+class FrameDecoder:
+    """Incrementally reassembles frames from arbitrary chunks of a byte stream."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """Append received bytes and return every payload completed by them."""
+        self.buffer += data
+        frames = []
+        offset = 0
+        while len(self.buffer) - offset >= FRAME_HEADER.size:
+            (length,) = FRAME_HEADER.unpack_from(self.buffer, offset)
+            if length > MAX_FRAME_SIZE:
+                raise ProtocolError(f"Frame of {length} bytes exceeds limit of {MAX_FRAME_SIZE}")
+            end = offset + FRAME_HEADER.size + length
+            if end > len(self.buffer):
+                break
+            frames.append(bytes(self.buffer[offset + FRAME_HEADER.size:end]))
+            offset = end
+        del self.buffer[:offset]
+        return frames
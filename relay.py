@@ -0,0 +1,400 @@
+"""Relay bus that lets several server nodes share boards.
+
+Boards are sharded across a fixed list of nodes with a consistent-hash ring.
+The node owning a board is its sequencer: it keeps the board's authoritative
+history (and journals it), and every stroke drawn on the board, whichever node
+its client is connected to, is forwarded to the owner, appended to the history
+there and published back to the nodes that currently have members on the
+board. Each node therefore fans out only to its own clients, and every node
+sees a board's strokes in the same order. Publishes carry the owner's order
+number for each payload, so clients on every node see the same numbering.
+
+Messages between nodes are (kind, board, sender, payload), where sender is the
+key of the client that drew a stroke, so its own node can skip echoing it back:
+
+* stroke: a node forwards a local client's payload to the board's owner,
+  with the client's sequence number so the client can be acknowledged.
+* publish: the owner sends a payload, its order and the sender's sequence
+  number to a subscribed node.
+* subscribe / unsubscribe: a node gains its first or loses its last member of a
+  board it does not own.
+* replay / synced: the owner answers a subscribe with the board's replay, in
+  chunks of concatenated frames, then a synced marker; publishes for that
+  board follow in order; synced carries the order the replay ends at. Both
+  echo the subscribe's token, so the answer to a
+  subscription that was since dropped and renewed is recognised and ignored,
+  as are publishes arriving before the current synced marker.
+
+Backends only move messages between named nodes, in order per pair of nodes:
+LoopbackBus for nodes in one process, TcpBus for nodes in separate processes
+that connect to a RelayHub over TCP or a Unix socket.
+"""
+import argparse
+import bisect
+import hashlib
+import queue
+import socket
+import struct
+import threading
+
+from outbox import SendBuffer
+from protocol import RECV_SIZE, FrameDecoder, encode_frame
+
+STROKE = 0
+PUBLISH = 1
+SUBSCRIBE = 2
+UNSUBSCRIBE = 3
+REPLAY = 4
+SYNCED = 5
+REGISTER = 6  # first message on a hub connection; source names the node
+
+RING_REPLICAS = 64  # points per node on the hash ring, evening out the shards
+REPLAY_CHUNK = 4 * 1024 * 1024  # bytes of history per replay message, well below the frame limit
+BUS_HEADER = struct.Struct("!BHHHH")  # kind, destination, source, board and sender lengths
+ORDER_HEADER = struct.Struct("!QQ?")  # board order, sender's sequence number, whether to echo the payload back
+
+
+def ring_hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent-hash assignment of boards to nodes."""
+
+    def __init__(self, nodes, replicas=RING_REPLICAS):
+        if not nodes:
+            raise ValueError("A hash ring needs at least one node")
+        self.nodes = sorted(set(nodes))
+        self._points = sorted((ring_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(replicas))
+        self._hashes = [point for point, _ in self._points]
+
+    def owner(self, board):
+        index = bisect.bisect(self._hashes, ring_hash(board)) % len(self._points)
+        return self._points[index][1]
+
+
+def encode_bus_message(dest, source, kind, board, sender, payload):
+    names = [name.encode() for name in (dest, source, board, sender)]
+    return encode_frame(BUS_HEADER.pack(kind, *map(len, names)) + b"".join(names) + payload)
+
+
+def decode_bus_message(body):
+    """(destination, source, kind, board, sender, payload) of a bus frame's body."""
+    kind, *lengths = BUS_HEADER.unpack_from(body)
+    offset = BUS_HEADER.size
+    names = []
+    for length in lengths:
+        names.append(body[offset:offset + length].decode())
+        offset += length
+    dest, source, board, sender = names
+    return dest, source, kind, board, sender, body[offset:]
+
+
+def encode_ordered(order, sequence, echo, payload):
+    return ORDER_HEADER.pack(order, sequence, echo) + payload
+
+
+def decode_ordered(payload):
+    """(order, sequence, echo, payload) of a stroke, publish or synced message's payload."""
+    return (*ORDER_HEADER.unpack_from(payload), payload[ORDER_HEADER.size:])
+
+
+def bus_destination(body):
+    _, dest_length, *_ = BUS_HEADER.unpack_from(body)
+    return body[BUS_HEADER.size:BUS_HEADER.size + dest_length].decode()
+
+
+class LoopbackBus:
+    """Bus between nodes in one process; each node's messages are handled on its own thread."""
+
+    def __init__(self):
+        self._inboxes = {}
+
+    def attach(self, node_id, handler):
+        inbox = self._inboxes[node_id] = queue.SimpleQueue()
+        threading.Thread(target=self._deliver, args=(inbox, handler), daemon=True).start()
+        return LoopbackEndpoint(self, node_id)
+
+    @staticmethod
+    def _deliver(inbox, handler):
+        while True:
+            message = inbox.get()
+            if message is None:
+                return
+            handler(*message)
+
+    def route(self, dest, message):
+        inbox = self._inboxes.get(dest)
+        if inbox is not None:
+            inbox.put(message)
+
+    def detach(self, node_id):
+        inbox = self._inboxes.pop(node_id, None)
+        if inbox is not None:
+            inbox.put(None)
+
+
+class LoopbackEndpoint:
+    dropped = 0  # a loopback bus never loses its link
+
+    def __init__(self, bus, node_id):
+        self.bus = bus
+        self.node_id = node_id
+
+    def send(self, dest, kind, board, sender, payload):
+        self.bus.route(dest, (self.node_id, kind, board, sender, bytes(payload)))
+
+    def close(self):
+        self.bus.detach(self.node_id)
+
+
+def connect_address(address):
+    """Socket connected to "host:port", or to a Unix socket path."""
+    if "/" in address:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(address)
+    else:
+        host, port = address.rsplit(":", 1)
+        sock = socket.create_connection((host, int(port)))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
+class TcpBus:
+    """Bus whose nodes each hold one connection to a RelayHub."""
+
+    def __init__(self, address):
+        self.address = address
+
+    def attach(self, node_id, handler):
+        return TcpEndpoint(connect_address(self.address), node_id, handler)
+
+
+class TcpEndpoint:
+    def __init__(self, connection, node_id, handler):
+        self.connection = connection
+        self.node_id = node_id
+        self.handler = handler
+        self.outbox = SendBuffer()  # only relay frames count against its capacity, so bus traffic never waits
+        self.dropped = 0  # messages sent after the link to the hub was lost
+        self.outbox.put(encode_bus_message("", node_id, REGISTER, "", "", b""))
+        threading.Thread(target=self._write_loop, daemon=True).start()
+        threading.Thread(target=self._read_loop, daemon=True).start()
+
+    def send(self, dest, kind, board, sender, payload):
+        if self.outbox.closed:
+            self.dropped += 1
+            if self.dropped == 1:
+                print("Dropping bus messages: the relay hub connection is gone")
+            return
+        self.outbox.put(encode_bus_message(dest, self.node_id, kind, board, sender, payload))
+
+    def _write_loop(self):
+        while True:
+            frames = self.outbox.next_batch()
+            if not frames:
+                return
+            try:
+                self.connection.sendall(b"".join(frames))
+            except OSError as e:
+                print(f"Lost connection to relay hub: {e}")
+                self.outbox.close()  # later sends are counted as dropped rather than queued forever
+                return
+
+    def _read_loop(self):
+        decoder = FrameDecoder()
+        while True:
+            try:
+                data = self.connection.recv(RECV_SIZE)
+            except OSError:
+                data = b""
+            if not data:
+                if not self.outbox.closed:
+                    print("Relay hub closed the connection")
+                    self.outbox.close()
+                return
+            for body in decoder.feed(data):
+                _, source, kind, board, sender, payload = decode_bus_message(body)
+                self.handler(source, kind, board, sender, payload)
+
+    def close(self):
+        self.outbox.close()
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class RelayHub:
+    """Routes bus frames between the nodes connected to it, without decoding payloads."""
+
+    def __init__(self, address):
+        if "/" in address:
+            self.server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.server_socket.bind(address)
+        else:
+            host, port = address.rsplit(":", 1)
+            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.server_socket.bind((host, int(port)))
+        self.server_socket.listen()
+        self._lock = threading.Lock()
+        self.nodes = {}  # node id -> SendBuffer drained onto that node's connection
+        print(f"Relay hub listening on {address}")
+
+    def handle_node(self, connection):
+        decoder = FrameDecoder()
+        node_id = None
+        outbox = SendBuffer()
+        try:
+            while True:
+                data = connection.recv(RECV_SIZE)
+                if not data:
+                    break
+                for body in decoder.feed(data):
+                    if node_id is None:
+                        _, node_id, *_ = decode_bus_message(body)
+                        with self._lock:
+                            self.nodes[node_id] = outbox
+                        threading.Thread(target=self.write_loop, args=(connection, outbox), daemon=True).start()
+                        print(f"Node {node_id} connected")
+                        continue
+                    target = self.nodes.get(bus_destination(body))
+                    if target is not None:
+                        target.put(encode_frame(body))
+        except OSError as e:
+            print(f"Error handling node {node_id}: {e}")
+        with self._lock:
+            if self.nodes.get(node_id) is outbox:
+                del self.nodes[node_id]
+        outbox.close()
+        connection.close()
+        print(f"Node {node_id} disconnected")
+
+    @staticmethod
+    def write_loop(connection, outbox):
+        while True:
+            frames = outbox.next_batch()
+            if not frames:
+                return
+            try:
+                connection.sendall(b"".join(frames))
+            except OSError:
+                return
+
+    def start(self):
+        while True:
+            connection, _ = self.server_socket.accept()
+            threading.Thread(target=self.handle_node, args=(connection,), daemon=True).start()
+
+
+class ClusterNode:
+    """This server's place in a cluster: which boards it owns and who subscribes to them."""
+
+    def __init__(self, node_id, nodes, bus):
+        self.node_id = node_id
+        self.ring = HashRing(nodes)
+        if node_id not in self.ring.nodes:
+            raise ValueError(f"Node {node_id!r} is not one of the cluster's nodes {self.ring.nodes}")
+        self.bus = bus
+        self.endpoint = None
+        self._lock = threading.Lock()
+        self.subscribers = {}  # owned board -> ids of other nodes with members on it
+        self.subscriptions = {}  # board owned elsewhere -> [token, True once its history has arrived]
+        self._tokens = 0
+
+    def start(self, handler):
+        """Attach to the bus; handler(source, kind, board, sender, payload) gets every incoming message."""
+        self.endpoint = self.bus.attach(self.node_id, handler)
+
+    def owns(self, board):
+        return self.ring.owner(board) == self.node_id
+
+    def forward(self, board, sender, sequence, echo, payload):
+        self.endpoint.send(self.ring.owner(board), STROKE, board, sender, encode_ordered(0, sequence, echo, payload))
+
+    def publish(self, board, sender, order, sequence, echo, payload):
+        """Send an ordered payload of an owned board to every subscribed node; call under the board lock."""
+        message = encode_ordered(order, sequence, echo, payload)
+        with self._lock:  # the relay thread removes subscribers without the board lock
+            nodes = tuple(self.subscribers.get(board, ()))
+        for node in nodes:
+            self.endpoint.send(node, PUBLISH, board, sender, message)
+
+    def add_subscriber(self, board, node, token, history, order):
+        """Register a node on an owned board and send it the history up to order; call under the board lock."""
+        with self._lock:
+            self.subscribers.setdefault(board, set()).add(node)
+        chunk = []
+        size = 0
+        for payload in history:
+            chunk.append(encode_frame(payload))
+            size += len(chunk[-1])
+            if size >= REPLAY_CHUNK:
+                self.endpoint.send(node, REPLAY, board, token, b"".join(chunk))
+                chunk, size = [], 0
+        if chunk:
+            self.endpoint.send(node, REPLAY, board, token, b"".join(chunk))
+        self.endpoint.send(node, SYNCED, board, token, encode_ordered(order, 0, False, b""))
+
+    def snapshot(self):
+        """Subscribed nodes per owned board, the boards followed elsewhere and bus messages lost with the link."""
+        with self._lock:
+            return {"subscribers": {board: sorted(nodes) for board, nodes in self.subscribers.items()},
+                    "subscriptions": sorted(self.subscriptions),
+                    "bus_dropped": self.endpoint.dropped if self.endpoint is not None else 0}
+
+    def remove_subscriber(self, board, node):
+        with self._lock:
+            nodes = self.subscribers.get(board)
+            if nodes is not None:
+                nodes.discard(node)
+                if not nodes:
+                    del self.subscribers[board]
+
+    def subscribe(self, board):
+        """Ask the owner for a board's history and updates, unless already subscribed."""
+        with self._lock:
+            if board in self.subscriptions:
+                return
+            self._tokens += 1
+            token = str(self._tokens)
+            self.subscriptions[board] = [token, False]
+        self.endpoint.send(self.ring.owner(board), SUBSCRIBE, board, token, b"")
+
+    def unsubscribe(self, board):
+        with self._lock:
+            if self.subscriptions.pop(board, None) is None:
+                return
+        self.endpoint.send(self.ring.owner(board), UNSUBSCRIBE, board, "", b"")
+
+    def synced(self, board):
+        subscription = self.subscriptions.get(board)
+        return subscription is not None and subscription[1]
+
+    def awaiting(self, board, token):
+        """Whether history tagged with token belongs to the board's current, unsynced subscription."""
+        return self.subscriptions.get(board) == [token, False]
+
+    def mark_synced(self, board, token):
+        with self._lock:
+            if self.awaiting(board, token):
+                self.subscriptions[board][1] = True
+
+    def close(self):
+        if self.endpoint is not None:
+            self.endpoint.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Relay hub connecting whiteboard server nodes")
+    parser.add_argument("address", help="host:port or Unix socket path to listen on")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    try:
+        RelayHub(args.address).start()
+    except KeyboardInterrupt:
+        pass
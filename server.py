@@ -1,50 +1,895 @@
+import argparse
+import asyncio
+import itertools
 import json
+import multiprocessing
+import os
+import shutil
+import signal
 import socket
+import tempfile
 import threading
+import time
+from contextlib import ExitStack
 
-class WhiteboardServer:
-    def __init__(self, host="127.0.0.1", port=12345):
-        self.clients = []
+from boards import BoardStore, pack_segments, payload_segments
+from handoff import handoff_path, listen_for_handoffs, receive_connections, send_connection
+from journal import CHECKPOINT_MIN_BYTES, CHECKPOINT_POLL_INTERVAL, BoardCheckpoint, StrokeJournal
+from metrics import Metrics, SamplingProfiler, StatsServer
+from outbox import (CONTROL, DEFAULT_SEND_BUFFER, DISCONNECT, DROP, HISTORY, RELAY, SLOW_CONSUMER_POLICIES, SNAPSHOT,
+                    AsyncSendBuffer, SendBuffer)
+from protocol import (DEFAULT_BOARD, JSON_CODEC, MAX_BOARD_NAME, RECV_SIZE, FrameDecoder, ProtocolError,
+                      check_stroke_payload, decode_message, decode_sequenced, encode_ack, encode_frame,
+                      encode_message, encode_sequenced, is_control, is_sequenced, negotiate_codec, transcode_frame)
+from relay import (PUBLISH, REPLAY, STROKE, SUBSCRIBE, SYNCED, UNSUBSCRIBE, ClusterNode, RelayHub, TcpBus,
+                   decode_ordered)
+from simplify import DEFAULT_FLUSH_INTERVAL, StrokeSimplifier
+
+
+class RelayFrames(dict):
+    """Frames of one relayed payload keyed by codec, each built on first use.
+
+    Payloads are forwarded as received; a binary batch is only decoded when a
+    recipient negotiated JSON.
+    """
+
+    def __init__(self, payload, metrics):
+        super().__init__()
+        self.payload = payload
+        self.metrics = metrics
+
+    def __missing__(self, codec):
+        started = time.perf_counter()
+        frame = self[codec] = transcode_frame(self.payload, codec)
+        self.metrics.observe("transcode_seconds", time.perf_counter() - started)
+        return frame
+
+
+class Peer:
+    """A connected client as seen by the fan-out path.
+
+    Sends are queued in a bounded outbox that the client's writer thread drains.
+    """
+
+    outbox_class = SendBuffer
+
+    def __init__(self, connection, peername, send_buffer=DEFAULT_SEND_BUFFER, key=""):
+        self.connection = connection
+        self.peername = peername
+        self.key = key  # names the client in messages between cluster nodes
+        self.codec = JSON_CODEC  # until the client's hello says otherwise
+        self.board = None  # set when the client's hello or join places it on a board
+        self.outbox = self.outbox_class(send_buffer)
+
+    def send(self, frame, kind=CONTROL):
+        """Queue a frame; returns False if a relayed frame found the outbox full."""
+        return self.outbox.put(frame, kind)
+
+    def fileno(self):
+        return self.connection.fileno()
+
+    def hold_input(self):
+        """Stop reading from the client and return bytes read but not yet handed to the decoder."""
+        return b""
+
+    def release_input(self):
+        pass
+
+    def close(self):
+        """Stop the writer and wake the handler thread blocked in recv so it can clean up."""
+        self.outbox.close()
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class AsyncPeer(Peer):
+    """Peer whose outbox is drained by a writer task on the event loop."""
+
+    outbox_class = AsyncSendBuffer
+
+    def __init__(self, connection, peername, send_buffer=DEFAULT_SEND_BUFFER, key="", reader=None):
+        super().__init__(connection, peername, send_buffer, key)
+        self.reader = reader
+
+    def fileno(self):
+        return self.connection.get_extra_info("socket").fileno()
+
+    def hold_input(self):
+        self.connection.transport.pause_reading()
+        return bytes(self.reader._buffer)  # StreamReader offers no public way to take back what it buffered
+
+    def release_input(self):
+        self.connection.transport.resume_reading()
+
+    def close(self):
+        self.outbox.close()
+        self.connection.close()
+
+
+class ClientRegistry:
+    """Thread-safe client membership, indexed by board.
+
+    Writers swap in new immutable per-board tuples under the lock, so
+    broadcasting threads iterate a consistent snapshot without holding the lock
+    while they send, and removals never disturb an iteration in progress.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._peers = {}
+        self._rooms = {}  # board -> {connection: Peer}
+        self._snapshots = {}  # board -> tuple of Peers
+
+    def _place(self, peer, board):
+        room = self._rooms.get(peer.board)
+        if room is not None and room.pop(peer.connection, None) is not None:
+            self._publish(peer.board)
+        peer.board = board
+        self._rooms.setdefault(board, {})[peer.connection] = peer
+        self._publish(board)
+
+    def _publish(self, board):
+        room = self._rooms.get(board)
+        if room:
+            self._snapshots[board] = tuple(room.values())
+        else:
+            self._rooms.pop(board, None)
+            self._snapshots.pop(board, None)
+
+    def add(self, peer):
+        with self._lock:
+            self._peers[peer.connection] = peer
+
+    def join(self, peer, board):
+        """Move a registered client to another board."""
+        with self._lock:
+            if peer.connection in self._peers:
+                self._place(peer, board)
+
+    def remove(self, connection):
+        """Forget a client; returns the Peer, or None if it was already gone."""
+        with self._lock:
+            peer = self._peers.pop(connection, None)
+            if peer is not None and peer.board in self._rooms:
+                self._rooms[peer.board].pop(connection, None)
+                self._publish(peer.board)
+            return peer
+
+    def members(self, board):
+        return self._snapshots.get(board, ())
+
+    def peers(self):
+        with self._lock:
+            return list(self._peers.values())
+
+    def boards(self):
+        """Member count of every board that currently has someone on it."""
+        with self._lock:
+            return {board: len(peers) for board, peers in self._snapshots.items()}
+
+    def __len__(self):
+        return len(self._peers)
+
+
+def board_name(message):
+    return str(message.get("board", "")).strip()[:MAX_BOARD_NAME]
+
+
+class RelayServer:
+    """Board routing and control handling shared by both server modes."""
+
+    def __init__(self, journal_path=None, simplify_tolerance=None, simplify_interval=DEFAULT_FLUSH_INTERVAL,
+                 send_buffer=DEFAULT_SEND_BUFFER, slow_policy=SNAPSHOT, node=None, handoff_dir=None,
+                 stats_port=None, stats_interval=None, checkpoint_bytes=CHECKPOINT_MIN_BYTES):
+        self.metrics = Metrics()
+        self.profiler = SamplingProfiler()
+        self.clients = ClientRegistry()
+        self.boards = BoardStore()
+        self.node = node  # ClusterNode when boards are shared with other servers
+        self.handoff_dir = handoff_dir  # set on worker processes, which pass clients to their board's owner
+        self.handoff_listener = None
+        if handoff_dir is not None:
+            self.handoff_listener = listen_for_handoffs(handoff_path(handoff_dir, node.node_id))
+        self.peer_keys = itertools.count()
+        self.send_buffer = send_buffer
+        self.slow_policy = slow_policy
+        self.simplifier = None
+        if simplify_tolerance is not None:
+            self.simplifier = StrokeSimplifier(simplify_tolerance, simplify_interval)
+        self.flush_lock = threading.RLock()  # keeps a sender's drained batches in order across threads
+        self.journal = None
+        if journal_path:
+            self.journal = StrokeJournal(journal_path, checkpoint_bytes=checkpoint_bytes)
+            checkpoints = self.restore()
+            self.journal.start()
+            if checkpoints:
+                threading.Thread(target=self.checkpoint_loop, daemon=True).start()
+        if stats_port is not None:
+            StatsServer(stats_port, self.stats, self.profiler).start()
+        if stats_interval:
+            threading.Thread(target=self.dump_stats, args=(stats_interval,), daemon=True).start()
+
+    def restore(self):
+        """Rebuild board history from the journal's checkpoint and the records after it.
+
+        Boards this node no longer owns are skipped: the cluster's nodes (or the
+        worker count) changed since they were journaled, and their owner's
+        history is the one members get. Checkpoints are then suspended, since a
+        new one would leave those boards out. A journal without a checkpoint may
+        come from a server that journaled payloads unchecked, so its records are
+        checked and malformed ones skipped; records after a checkpoint were
+        checked on their way in. Returns whether checkpoints may be written.
+        """
+        started = time.perf_counter()
+        start = 0
+        offsets = {}  # board -> journal offset its checkpoint covers
+        foreign = {}  # board owned elsewhere -> records skipped
+        checkpointed = 0
+        loaded = self.journal.load_snapshot()
+        if loaded is not None:
+            start, checkpoints = loaded
+            for checkpoint in checkpoints:
+                if not self.owns(checkpoint.board):
+                    foreign[checkpoint.board] = len(checkpoint.chunks) + len(checkpoint.pending)
+                    continue
+                offsets[checkpoint.board] = checkpoint.offset
+                state = self.boards.get(checkpoint.board)
+                with state.lock:  # the compactor folds restored history as it goes
+                    state.load(checkpoint.sequence, checkpoint.chunks, checkpoint.pending)
+                checkpointed += len(checkpoint.chunks) + len(checkpoint.pending)
+        records = 0
+        invalid = 0
+        restored = {}  # board -> journal payloads newer than its checkpoint
+        unchecked = loaded is None
+        for offset, board, payload in self.journal.replay(start):
+            if offset < offsets.get(board, start):
+                continue
+            payloads = restored.get(board)
+            if payloads is None:
+                if not self.owns(board):
+                    foreign[board] = foreign.get(board, 0) + 1
+                    continue
+                payloads = restored[board] = []
+            if unchecked:
+                try:
+                    check_stroke_payload(payload)
+                except ProtocolError:
+                    invalid += 1
+                    continue
+            payloads.append(payload)
+            records += 1
+        for board, payloads in restored.items():
+            state = self.boards.get(board)
+            with state.lock:
+                for payload in payloads:
+                    state.restore(payload)
+        print(f"Restored {checkpointed} checkpointed payloads and {records} newer records "
+              f"({self.journal.valid_size - start} bytes) on {len(self.boards.names())} boards "
+              f"in {time.perf_counter() - started:.2f}s")
+        if foreign:
+            print(f"Skipped {sum(foreign.values())} records on {len(foreign)} boards owned by other nodes: "
+                  f"{', '.join(sorted(foreign))}. Run with the nodes or --workers count the journal was written "
+                  f"with to serve them; journal checkpoints are off until then.")
+        if invalid:
+            print(f"Skipped {invalid} malformed records")
+        return not foreign
+
+    def checkpoint_loop(self):
+        while True:
+            time.sleep(CHECKPOINT_POLL_INTERVAL)
+            if self.journal.checkpoint_due():
+                self.checkpoint()
+
+    def checkpoint(self):
+        """Write every owned board's history to the journal's snapshot, so a restart replays only newer records.
+
+        Each board is captured under its own lock along with the journal
+        offset its records have reached, so boards stay available while the
+        others are captured and no record is both checkpointed and replayed.
+        """
+        started = time.perf_counter()
+        start = self.journal.appended_size
+        checkpoints = []
+        for board in self.boards.names():
+            if not self.owns(board):
+                continue
+            state = self.boards.get(board)
+            with state.lock:
+                checkpoints.append(BoardCheckpoint(board, self.journal.appended_size, *state.checkpoint()))
+        if self.journal.write_snapshot(start, checkpoints):
+            self.metrics.observe("checkpoint_seconds", time.perf_counter() - started)
+
+    def close(self):
+        if self.simplifier is not None:
+            self.flush_simplified()
+            print(f"Simplified {self.simplifier.segments_in} segments to {self.simplifier.segments_out}")
+        counters = self.metrics.snapshot("close")["counters"]
+        print("Slow consumers: " + ", ".join(f"{event} {counters.get(f'slow_consumer_{event}', 0)}"
+                                              for event in ("dropped_frames", "snapshots", "disconnects")))
+        if self.node is not None:
+            self.node.close()
+        if self.journal is not None:
+            self.journal.close()
+
+    def stats(self, consumer=None):
+        """Metrics snapshot for consumer plus the current state of clients, send queues, boards and the cluster link."""
+        snapshot = self.metrics.snapshot(consumer)
+        peers = self.clients.peers()
+        queues = sorted(((len(peer.outbox), peer.outbox.relay_bytes, str(peer.peername)) for peer in peers),
+                        reverse=True)
+        snapshot["clients"] = len(peers)
+        snapshot["send_queues"] = {
+            "frames": sum(frames for frames, _, _ in queues),
+            "relay_bytes": sum(size for _, size, _ in queues),
+            "deepest": [{"client": name, "frames": frames, "relay_bytes": size}
+                        for frames, size, name in queues[:5] if frames],
+        }
+        for board, members in self.clients.boards().items():
+            snapshot["boards"].setdefault(board, {"payloads": 0, "bytes": 0})["members"] = members
+        if self.simplifier is not None:
+            snapshot["simplifier"] = {"segments_in": self.simplifier.segments_in,
+                                      "segments_out": self.simplifier.segments_out}
+        if self.node is not None:
+            snapshot["node"] = {"id": self.node.node_id, **self.node.snapshot()}
+        return snapshot
+
+    def dump_stats(self, interval):
+        """Print a stats snapshot as one JSON line every interval seconds."""
+        while True:
+            time.sleep(interval)
+            print(json.dumps(self.stats("dump")), flush=True)
+
+    def new_peer_key(self):
+        key = str(next(self.peer_keys))
+        return f"{self.node.node_id}/{key}" if self.node is not None else key
+
+    def owns(self, board):
+        """Whether this server holds the authoritative history of a board."""
+        return self.node is None or self.node.owns(board)
+
+    def broadcast(self, payload, sender, sequence=0, echo=False):
+        """Record drawing data in the board log and queue it for every other client on the board.
+
+        sequence is the sender's number for the data, acknowledged once the data
+        has its place in the board's order; with echo the ack carries the
+        payload too, for when it differs from what the sender drew.
+        """
+        if sender.board is None:
+            self.join_board(sender, DEFAULT_BOARD)
+        if not self.owns(sender.board):
+            self.node.forward(sender.board, sender.key, sequence, echo, payload)  # back through the owner's publish
+            self.metrics.count("relay_forwarded")
+            return
+        self.deliver(sender.board, payload, sender.key, sequence, echo)
+
+    def deliver(self, board, payload, sender_key, sequence=0, echo=False, order=None):
+        """Append a payload to a board's log and queue it for every local member.
+
+        On the board's owner this is where the payload gets its place in the
+        board's order: it is numbered, journaled and published to subscribed
+        nodes under the same lock; elsewhere order is the owner's number. The
+        frames are queued under the lock too, so every member receives the
+        board's payloads in that order. Other members get the payload wrapped
+        with its order, the sender an ack. Each codec's frame is built once and
+        the same bytes object is handed to every recipient.
+        """
+        started = time.perf_counter()
+        state = self.boards.get(board)
+        with state.lock:
+            order = state.append(payload, order)
+            if self.owns(board):
+                if self.journal is not None:
+                    self.journal.append(board, payload)
+                if self.node is not None:
+                    self.node.publish(board, sender_key, order, sequence, echo, payload)
+            frames = RelayFrames(encode_sequenced(order, payload), self.metrics)
+            slow = []
+            for peer in self.clients.members(board):
+                if peer.key != sender_key:
+                    if not peer.send(frames[peer.codec], RELAY):
+                        slow.append(peer)
+                elif sequence:
+                    peer.send(transcode_frame(encode_ack(order, sequence, payload if echo else b""), peer.codec))
+            for peer in slow:
+                self.handle_slow_consumer(peer, frames[peer.codec])
+        self.metrics.observe("fanout_seconds", time.perf_counter() - started)
+        self.metrics.count_board(board, len(payload))
+
+    def count_slow(self, event, amount=1):
+        self.metrics.count(f"slow_consumer_{event}", amount)
+
+    def handle_slow_consumer(self, peer, frame):
+        """Apply the slow-consumer policy to a peer whose outbox had no room for frame.
+
+        snapshot: drop everything queued for it and replay the board from the
+        compacted history instead; drop: discard its oldest queued strokes to
+        make room; disconnect: close the connection.
+        """
+        if self.slow_policy == DROP:
+            self.count_slow("dropped_frames", peer.outbox.make_room(len(frame)))
+            peer.outbox.put(frame, RELAY, force=True)
+        elif self.slow_policy == SNAPSHOT:
+            self.count_slow("snapshots")
+            self.join_board(peer, peer.board, resync=True)
+        elif self.slow_policy == DISCONNECT:
+            self.count_slow("disconnects")
+            print(f"Disconnecting slow client {peer.peername}")
+            self.drop_client(peer)
+
+    def join_board(self, peer, board, resync=False):
+        """Move a peer to a board and replay that board's history to it.
+
+        Both boards stay locked until the replay is handed to the peer, so no
+        stroke is missed, duplicated or delivered ahead of the history. With
+        resync, whatever is still queued for the peer is discarded first, since
+        the replay supersedes it.
+        """
+        if self.simplifier is not None and peer.board not in (None, board):
+            self.flush_sender(peer)  # strokes drawn before the switch belong to the old board
+        started = time.perf_counter()
+        states = {board: self.boards.get(board)}
+        if peer.board is not None:
+            states.setdefault(peer.board, self.boards.get(peer.board))
+        with ExitStack() as stack:
+            for name in sorted(states):  # fixed lock order between concurrent joins
+                stack.enter_context(states[name].lock)
+            if resync:
+                peer.outbox.discard_board_frames()
+            old_board = peer.board
+            self.clients.join(peer, board)
+            synced = self.owns(board) or self.node.synced(board)  # otherwise the owner's order is not known yet
+            peer.send(encode_message({"type": "joined", "board": board,
+                                      "seq": states[board].sequence if synced else None}), HISTORY)
+            for payload in states[board].replay():
+                peer.send(transcode_frame(payload, peer.codec), HISTORY)
+            if not self.owns(board):
+                self.node.subscribe(board)  # members get the owner's history once it arrives
+            if old_board not in (None, board):
+                self.release_board(old_board)
+        self.metrics.observe("join_seconds", time.perf_counter() - started)
+
+    def release_board(self, board):
+        """Stop following a board owned elsewhere once no local client is on it."""
+        if self.owns(board):
+            return
+        state = self.boards.get(board)
+        with state.lock:
+            if not self.clients.members(board):
+                self.node.unsubscribe(board)
+                state.clear()
+
+    def remove_client(self, peer):
+        """Forget a client; returns False if it was already gone."""
+        if self.clients.remove(peer.connection) is None:
+            return False
+        if peer.board is not None:
+            self.release_board(peer.board)
+        return True
+
+    def drop_client(self, peer):
+        if self.remove_client(peer):
+            peer.close()
+
+    def handle_relay(self, source, kind, board, sender, payload):
+        """Act on a message from another cluster node."""
+        self.metrics.count("relay_received")
+        if kind == STROKE:
+            _, sequence, echo, payload = decode_ordered(payload)
+            self.deliver(board, payload, sender, sequence, echo)
+        elif kind == PUBLISH:
+            if self.node.synced(board):
+                order, sequence, echo, payload = decode_ordered(payload)
+                self.deliver(board, payload, sender, sequence, echo, order)
+        elif kind == SUBSCRIBE:
+            state = self.boards.get(board)
+            with state.lock:
+                self.node.add_subscriber(board, source, sender, state.replay(), state.sequence)
+        elif kind == UNSUBSCRIBE:
+            self.node.remove_subscriber(board, source)
+        elif kind == REPLAY:
+            state = self.boards.get(board)
+            with state.lock:
+                if not self.node.awaiting(board, sender):
+                    return
+                payloads = FrameDecoder().feed(payload)
+                for history in payloads:
+                    state.restore(history)
+                for peer in self.clients.members(board):
+                    for history in payloads:
+                        peer.send(transcode_frame(history, peer.codec), HISTORY)
+        elif kind == SYNCED:
+            state = self.boards.get(board)
+            with state.lock:
+                if self.node.awaiting(board, sender):
+                    state.sequence = decode_ordered(payload)[0]
+                    self.node.mark_synced(board, sender)
+
+    def handle_data(self, peer, decoder, data):
+        """Handle bytes received from a client; returns True if the client was handed to another worker."""
+        payloads = decoder.feed(data)
+        self.metrics.count("bytes_in", len(data))
+        self.metrics.count("messages_in", len(payloads))
+        for index, payload in enumerate(payloads):
+            owner = self.handoff_target(payload, peer)
+            if owner is not None:
+                unread = b"".join(encode_frame(pending) for pending in payloads[index:]) + bytes(decoder.buffer)
+                try:
+                    send_connection(handoff_path(self.handoff_dir, owner), peer.fileno(), unread + peer.hold_input())
+                    self.metrics.count("handoffs_out")
+                    return True
+                except OSError as e:
+                    print(f"Could not hand client {peer.peername} to {owner}, serving it here: {e}")
+                    peer.release_input()
+            self.handle_payload(payload, peer)
+        return False
+
+    def handoff_target(self, payload, peer):
+        """The worker to pass a new client to: the owner of the board its hello asks for, if not this one."""
+        if self.handoff_dir is None or peer.board is not None or not is_control(payload):
+            return None
+        message = decode_message(payload)
+        if message.get("type") != "hello":
+            return None
+        owner = self.node.ring.owner(board_name(message) or DEFAULT_BOARD)
+        return owner if owner != self.node.node_id else None
+
+    def handle_payload(self, payload, peer):
+        """Answer control messages and relay stroke batches untouched, or via the simplifier if enabled.
+
+        A batch is checked once here, before it can reach the board log, the
+        journal or another member; anything that is not a well-formed batch,
+        including an unknown control message or one wrapped in an envelope, is
+        dropped.
+        """
+        sequence = 0
+        if is_sequenced(payload):
+            sequence, payload = decode_sequenced(payload)
+        elif is_control(payload):
+            started = time.perf_counter()
+            message = decode_message(payload)
+            self.metrics.observe("decode_seconds", time.perf_counter() - started)
+            if self.handle_control(message, peer):
+                return
+        started = time.perf_counter()
+        try:
+            check_stroke_payload(payload)
+        except ProtocolError as e:
+            self.metrics.count("rejected_payloads")
+            print(f"Rejected payload from {peer.peername}: {e}")
+            return
+        self.metrics.observe("check_seconds", time.perf_counter() - started)
+        if self.simplifier is not None:
+            started = time.perf_counter()
+            segments = payload_segments(payload)
+            self.metrics.observe("decode_seconds", time.perf_counter() - started)
+            self.simplifier.add(peer, segments, sequence)
+            return
+        self.broadcast(payload, peer, sequence)  # Broadcast received data
+
+    def flush_simplified(self):
+        """Relay every sender's simplified strokes as one batch each; run once per flush interval."""
+        with self.flush_lock:
+            for peer, segments, sequence in self.simplifier.drain():
+                self.broadcast(self.pack(segments), peer, sequence, echo=True)
+
+    def flush_sender(self, peer):
+        """Relay a sender's pending strokes now, before it leaves or switches boards."""
+        with self.flush_lock:
+            segments, sequence = self.simplifier.drain_sender(peer)
+            if segments:
+                self.broadcast(self.pack(segments), peer, sequence, echo=True)
+
+    def pack(self, segments):
+        started = time.perf_counter()
+        payload = pack_segments(segments)
+        self.metrics.observe("encode_seconds", time.perf_counter() - started)
+        return payload
+
+    def handle_control(self, message, peer):
+        """Act on a control message; returns False for anything the server does not know."""
+        kind = message.get("type")
+        if kind == "hello":
+            peer.codec = negotiate_codec(message.get("codecs", []))
+            peer.send(encode_message({"type": "welcome", "codec": peer.codec}))
+            self.join_board(peer, board_name(message) or DEFAULT_BOARD)
+        elif kind == "join":
+            self.join_board(peer, board_name(message) or peer.board or DEFAULT_BOARD)
+        elif kind == "ping":
+            peer.send(encode_message({"type": "pong", "time": message.get("time")}))
+        elif kind == "list_boards":
+            boards = dict.fromkeys(self.boards.names(), 0)
+            boards.update(self.clients.boards())
+            boards.setdefault(DEFAULT_BOARD, 0)
+            peer.send(encode_message({"type": "boards", "boards": [
+                {"name": name, "members": count} for name, count in sorted(boards.items())]}))
+        else:
+            return False
+        return True
+
+
+class WhiteboardServer(RelayServer):
+    def __init__(self, host="127.0.0.1", port=12345, journal_path=None, reuse_port=False, **options):
+        super().__init__(journal_path, **options)
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if reuse_port:
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self.server_socket.bind((host, port))
         self.server_socket.listen(5)
         print(f"Server listening on {host}:{port}")
 
-    def broadcast(self, data, sender_socket):
-        """Send drawing data to all clients except the sender."""
-        for client in self.clients:
-            if client != sender_socket:
-                try:
-                    client.sendall(json.dumps(data).encode())  # Broadcast as JSON
-                except Exception as e:
-                    print(f"Error sending data to client {client.getpeername()}: {e}")
-                    self.clients.remove(client)
-
-    def handle_client(self, client_socket):
-        """Handle communication with a single client."""
-        self.clients.append(client_socket)
-        while True:
+    def handle_client(self, client_socket, peername, unread=b""):
+        """Handle communication with a single client, starting with any bytes another worker read."""
+        peer = Peer(client_socket, peername, self.send_buffer, self.new_peer_key())
+        self.clients.add(peer)
+        self.metrics.count("connections_opened")
+        writer = threading.Thread(target=self.write_loop, args=(peer,), daemon=True)
+        writer.start()
+        decoder = FrameDecoder()
+        handed_off = False
+        while not handed_off:
             try:
-                data = client_socket.recv(1024)
+                data = unread or client_socket.recv(RECV_SIZE)
+                unread = b""
                 if data:
-                    data = json.loads(data)
-                    self.broadcast(data, client_socket)  # Broadcast received data
+                    handed_off = self.handle_data(peer, decoder, data)
                 else:
                     break
             except Exception as e:
-                print(f"Error handling client {client_socket.getpeername()}: {e}")
+                print(f"Error handling client {peername}: {e}")
                 break
+        if self.simplifier is not None:
+            self.flush_sender(peer)
+        self.remove_client(peer)
+        self.metrics.count("connections_closed")
+        if handed_off:
+            peer.outbox.close()  # the connection lives on in the worker it was passed to
+        else:
+            peer.close()
+        writer.join()
         client_socket.close()
-        self.clients.remove(client_socket)
+
+    def adopt_client(self, connection, unread):
+        """Serve a client handed over by another worker."""
+        self.metrics.count("handoffs_in")
+        threading.Thread(target=self.handle_client, args=(connection, connection.getpeername(), unread),
+                         daemon=True).start()
+
+    def write_loop(self, peer):
+        """Drain one client's outbox onto its socket, a whole batch per sendall."""
+        while True:
+            frames = peer.outbox.next_batch()
+            if not frames:
+                return
+            data = b"".join(frames)
+            try:
+                peer.connection.sendall(data)
+            except OSError as e:
+                if not peer.outbox.closed:
+                    print(f"Error sending data to client {peer.peername}: {e}")
+                    self.drop_client(peer)
+                return
+            self.metrics.count("messages_out", len(frames))
+            self.metrics.count("bytes_out", len(data))
+
+    def simplify_loop(self):
+        while True:
+            time.sleep(self.simplifier.flush_interval)
+            self.flush_simplified()
 
     def start(self):
         """Accept new clients and start a thread for each."""
+        if self.node is not None:
+            self.node.start(self.handle_relay)
+        if self.simplifier is not None:
+            threading.Thread(target=self.simplify_loop, daemon=True).start()
+        if self.handoff_listener is not None:
+            threading.Thread(target=receive_connections, args=(self.handoff_listener, self.adopt_client),
+                             daemon=True).start()
+        while True:
+            client_socket, peername = self.server_socket.accept()
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # frames are small; don't wait on ACKs
+            print(f"New client connected: {peername}")
+            threading.Thread(target=self.handle_client, args=(client_socket, peername), daemon=True).start()
+
+
+class AsyncWhiteboardServer(RelayServer):
+    """Single-threaded asyncio server speaking the same protocol as WhiteboardServer.
+
+    Every client gets its own bounded outbox drained by a dedicated writer task,
+    so broadcasting only enqueues and never waits on a slow peer.
+    """
+
+    def __init__(self, host="127.0.0.1", port=12345, journal_path=None, reuse_port=False, **options):
+        super().__init__(journal_path, **options)
+        self.host = host
+        self.port = port
+        self.reuse_port = reuse_port
+        self.simplify_task = None
+
+    async def write_loop(self, peer):
+        """Drain one client's outbox onto its socket."""
+        writer = peer.connection
+        try:
+            while True:
+                frames = await peer.outbox.next_batch()
+                if not frames:
+                    return
+                writer.writelines(frames)
+                self.metrics.count("messages_out", len(frames))
+                self.metrics.count("bytes_out", sum(map(len, frames)))
+                await writer.drain()
+        except (ConnectionError, OSError) as e:
+            print(f"Error sending data to client {peer.peername}: {e}")
+            self.drop_client(peer)
+
+    async def handle_client(self, reader, writer, unread=b""):
+        """Handle communication with a single client, starting with any bytes another worker read."""
+        peername = writer.get_extra_info("peername")
+        print(f"New client connected: {peername}")
+        peer = AsyncPeer(writer, peername, self.send_buffer, self.new_peer_key(), reader)
+        self.clients.add(peer)
+        self.metrics.count("connections_opened")
+        writer_task = asyncio.create_task(self.write_loop(peer))
+        decoder = FrameDecoder()
+        handed_off = False
+        try:
+            while not handed_off:
+                data = unread or await reader.read(RECV_SIZE)
+                unread = b""
+                if not data:
+                    break
+                handed_off = self.handle_data(peer, decoder, data)
+                await asyncio.sleep(0)  # let writer tasks drain outboxes while this client keeps sending
+        except Exception as e:
+            print(f"Error handling client {peername}: {e}")
+        finally:
+            if self.simplifier is not None:
+                self.flush_sender(peer)
+            self.remove_client(peer)
+            self.metrics.count("connections_closed")
+            writer_task.cancel()
+            writer.close()  # closes only this worker's descriptor of a handed-off connection
+
+    async def adopt_client(self, connection, unread):
+        """Serve a client handed over by another worker."""
+        self.metrics.count("handoffs_in")
+        reader, writer = await asyncio.open_connection(sock=connection)
+        await self.handle_client(reader, writer, unread)
+
+    async def simplify_loop(self):
         while True:
-            client_socket, _ = self.server_socket.accept()
-            print(f"New client connected: {client_socket.getpeername()}")
-            threading.Thread(target=self.handle_client, args=(client_socket,), daemon=True).start()
+            await asyncio.sleep(self.simplifier.flush_interval)
+            self.flush_simplified()
+
+    async def serve(self):
+        if self.node is not None:
+            loop = asyncio.get_running_loop()
+            self.node.start(lambda *message: loop.call_soon_threadsafe(self.handle_relay, *message))
+        if self.simplifier is not None:
+            self.simplify_task = asyncio.create_task(self.simplify_loop())
+        if self.handoff_listener is not None:
+            loop = asyncio.get_running_loop()
+
+            def adopt(connection, unread):
+                asyncio.run_coroutine_threadsafe(self.adopt_client(connection, unread), loop)
+
+            threading.Thread(target=receive_connections, args=(self.handoff_listener, adopt), daemon=True).start()
+        server = await asyncio.start_server(self.handle_client, self.host, self.port, reuse_port=self.reuse_port)
+        print(f"Server listening on {self.host}:{self.port}")
+        async with server:
+            await server.serve_forever()
+
+    def start(self):
+        """Run the event loop until interrupted."""
+        asyncio.run(self.serve())
+
+
+SERVER_MODES = {"threaded": WhiteboardServer, "asyncio": AsyncWhiteboardServer}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Whiteboard relay server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=12345)
+    parser.add_argument("--mode", choices=sorted(SERVER_MODES), default="threaded",
+                        help="threaded: one thread per client; asyncio: single event loop with per-client send queues")
+    parser.add_argument("--journal", metavar="PATH",
+                        help="append every stroke to this file and restore boards from it on startup")
+    parser.add_argument("--checkpoint-mb", type=float, default=CHECKPOINT_MIN_BYTES / 2**20, metavar="MB",
+                        help="checkpoint the boards to PATH.snapshot once the journal grew this much, or by the "
+                             "snapshot's size if larger, so a restart replays only newer records "
+                             "(default: %(default)g)")
+    parser.add_argument("--send-buffer", type=int, default=DEFAULT_SEND_BUFFER // 1024, metavar="KB",
+                        help="relayed strokes queued per client before it counts as a slow consumer "
+                             "(default: %(default)s)")
+    parser.add_argument("--slow-policy", choices=SLOW_CONSUMER_POLICIES, default=SNAPSHOT,
+                        help="snapshot: replace a slow client's backlog with a board replay; drop: discard its "
+                             "oldest queued strokes; disconnect: close it (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="run this many worker processes sharing the port; each owns a share of the boards "
+                             "and clients are passed to the worker owning their board. With --journal each "
+                             "worker keeps PATH.workerN, so keep the count fixed once journals exist")
+    parser.add_argument("--node", help="this server's name in a cluster sharing boards over --relay-hub")
+    parser.add_argument("--nodes", help="comma-separated names of every node in the cluster, the same on each node; "
+                                        "a journal only restores the boards its node still owns")
+    parser.add_argument("--relay-hub", metavar="ADDRESS",
+                        help="host:port or Unix socket path of the relay hub (run with python relay.py ADDRESS)")
+    parser.add_argument("--stats-port", type=int, metavar="PORT",
+                        help="serve metrics at http://127.0.0.1:PORT/stats and profiler controls under /profile "
+                             "(worker N listens on PORT + N)")
+    parser.add_argument("--stats-interval", type=float, metavar="SECONDS",
+                        help="also print a metrics snapshot as one JSON line every SECONDS")
+    parser.add_argument("--simplify", type=float, metavar="PIXELS",
+                        help="merge each sender's segments into polylines, drop points within PIXELS of the "
+                             "simplified line and relay the result once per --simplify-interval")
+    parser.add_argument("--simplify-interval", type=float, default=DEFAULT_FLUSH_INTERVAL * 1000, metavar="MS",
+                        help="how often a sender's simplified strokes are relayed (default: %(default)g)")
+    args = parser.parse_args(argv)
+    if bool(args.node) != bool(args.relay_hub):
+        parser.error("--node and --relay-hub go together")
+    if args.workers > 1 and args.node:
+        parser.error("--workers runs its own relay hub and cannot join another cluster")
+    return args
+
+
+def build_server(args, journal_path, node=None, **options):
+    return SERVER_MODES[args.mode](args.host, args.port, journal_path=journal_path,
+                                   simplify_tolerance=args.simplify, simplify_interval=args.simplify_interval / 1000,
+                                   send_buffer=args.send_buffer * 1024, slow_policy=args.slow_policy, node=node,
+                                   stats_interval=args.stats_interval,
+                                   checkpoint_bytes=int(args.checkpoint_mb * 2**20), **options)
+
+
+def run(server):
+    try:
+        server.start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+def run_worker(args, name, workers, runtime):
+    """One worker process: a cluster node listening on the shared port."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the parent decides when workers stop
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    node = ClusterNode(name, workers, TcpBus(os.path.join(runtime, "hub.sock")))
+    journal_path = f"{args.journal}.{name}" if args.journal else None
+    stats_port = args.stats_port + workers.index(name) if args.stats_port is not None else None
+    run(build_server(args, journal_path, node, reuse_port=True, handoff_dir=runtime, stats_port=stats_port))
+
+
+def run_workers(args):
+    """Start args.workers processes sharing the port, linked by a relay hub on a Unix socket."""
+    signal.signal(signal.SIGTERM, signal.default_int_handler)  # stop the workers too when terminated
+    runtime = tempfile.mkdtemp(prefix="whiteboard-")
+    hub = RelayHub(os.path.join(runtime, "hub.sock"))
+    threading.Thread(target=hub.start, daemon=True).start()
+    names = [f"worker{i}" for i in range(args.workers)]
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=run_worker, args=(args, name, names, runtime), name=name) for name in names]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+        for process in processes:  # let them close their journals
+            process.join()
+    finally:
+        shutil.rmtree(runtime, ignore_errors=True)
 
 
 if __name__ == "__main__":
-    server = WhiteboardServer()
-    server.start()
+    args = parse_args()
+    if args.workers > 1:
+        run_workers(args)
+    else:
+        node = None
+        if args.node:
+            node = ClusterNode(args.node, (args.nodes or args.node).split(","), TcpBus(args.relay_hub))
+        run(build_server(args, args.journal, node, stats_port=args.stats_port))
@@ -0,0 +1,110 @@
+"""Optional server stage that coalesces and simplifies each sender's strokes before fan-out.
+
+Incoming segments are stitched into per-sender polylines instead of being
+relayed one batch at a time. Every flush interval the pending polylines are
+reduced with Ramer-Douglas-Peucker (dropping points that lie within the pixel
+tolerance of the simplified line) and emitted as one batch per sender, so a
+fast drawer produces at most one outbound message per interval. Polylines keep
+their endpoints, so a stroke that continues in the next interval still joins up.
+The newest sequence number a sender put on its input is emitted with the batch,
+so the server can acknowledge everything the batch replaced.
+"""
+import math
+import threading
+
+from protocol import is_spray
+
+DEFAULT_TOLERANCE = 1.0
+DEFAULT_FLUSH_INTERVAL = 0.05
+
+
+def simplify_polyline(points, tolerance):
+    """Ramer-Douglas-Peucker: keep the points that deviate more than tolerance from the simplified line."""
+    if len(points) < 3:
+        return points
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        x1, y1 = points[first]
+        x2, y2 = points[last]
+        dx, dy = x2 - x1, y2 - y1
+        norm = math.hypot(dx, dy)
+        farthest, index = tolerance, None
+        for i in range(first + 1, last):
+            px, py = points[i]
+            if norm:
+                distance = abs(dy * (px - x1) - dx * (py - y1)) / norm
+            else:
+                distance = math.hypot(px - x1, py - y1)
+            if distance > farthest:
+                farthest, index = distance, i
+        if index is not None:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+def _pen_fields(segment):
+    return {"pen_color": segment["pen_color"], "pen_width": segment["pen_width"],
+            "pen_style": segment["pen_style"], "pen_cap": segment["pen_cap"]}
+
+
+class StrokeSimplifier:
+    def __init__(self, tolerance=DEFAULT_TOLERANCE, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.tolerance = tolerance
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pending = {}  # sender -> list of [pen fields, points] polylines and spray dicts, in order
+        self._sequences = {}  # sender -> newest sequence number of its pending input
+        self.segments_in = 0
+        self.segments_out = 0
+
+    def add(self, sender, segments, sequence=0):
+        """Queue a sender's segments, extending its newest polyline where they connect."""
+        with self._lock:
+            if sequence:
+                self._sequences[sender] = sequence
+            pending = self._pending.setdefault(sender, [])
+            for segment in segments:
+                self.segments_in += 1
+                if is_spray(segment):
+                    pending.append(segment)
+                    continue
+                pen = _pen_fields(segment)
+                start = (segment["last_point_x"], segment["last_point_y"])
+                end = (segment["current_point_x"], segment["current_point_y"])
+                newest = pending[-1] if pending else None
+                if isinstance(newest, list) and newest[0] == pen and newest[1][-1] == start:
+                    newest[1].append(end)
+                else:
+                    pending.append([pen, [start, end]])
+
+    def _emit(self, pending):
+        segments = []
+        for entry in pending:
+            if isinstance(entry, dict):
+                segments.append(entry)
+                continue
+            pen, points = entry
+            points = simplify_polyline(points, self.tolerance)
+            for (x1, y1), (x2, y2) in zip(points, points[1:]):
+                segments.append({"last_point_x": x1, "last_point_y": y1, "current_point_x": x2,
+                                 "current_point_y": y2, **pen})
+        self.segments_out += len(segments)
+        return segments
+
+    def drain(self):
+        """Simplified segments of every sender with pending input, as (sender, segments, sequence) triples."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            sequences, self._sequences = self._sequences, {}
+            return [(sender, self._emit(entries), sequences.get(sender, 0))
+                    for sender, entries in pending.items() if entries]
+
+    def drain_sender(self, sender):
+        """Simplified pending segments of one sender and their sequence, e.g. when it disconnects."""
+        with self._lock:
+            return self._emit(self._pending.pop(sender, [])), self._sequences.pop(sender, 0)
@@ -0,0 +1,165 @@
+"""Retained vector model of the strokes on a board.
+
+Connected segments drawn with the same pen are stitched back into strokes whose
+points live in flat array('i') runs, and pen attributes are interned so each
+stroke stores a small integer instead of its pen. A uniform grid maps cells to
+the strokes crossing them, so region queries (and re-rasterizing a region) only
+visit strokes near that region, however many strokes the board holds.
+
+A segment only extends a stroke when no newer stroke may lie under it, so
+redrawing strokes in id order reproduces the order they were drawn in.
+"""
+from array import array
+from collections import OrderedDict
+
+from inbox import pen_key, segment_bounds
+from protocol import SPRAY_REACH, is_spray
+
+GRID_CELL = 256
+LINE = 0
+SPRAY = 1
+OPEN_STROKES = 256  # recently extended strokes a following segment may continue
+SPRAY_JOIN_DISTANCE = 2 * SPRAY_REACH  # in diameters; farther sprays start a new stroke
+
+
+class Stroke:
+    __slots__ = ("id", "kind", "pen", "points", "bounds")
+
+    def __init__(self, stroke_id, kind, pen):
+        self.id = stroke_id
+        self.kind = kind
+        self.pen = pen  # index into StrokeStore.pens
+        self.points = array("i")  # x, y pairs for lines; x, y, seed triples for sprays
+        self.bounds = None  # inclusive (left, top, right, bottom)
+
+    def frozen(self):
+        """Copy whose points stop growing with the stroke."""
+        copy = Stroke(self.id, self.kind, self.pen)
+        copy.points = array("i", self.points)
+        return copy
+
+
+class StrokeStore:
+    def __init__(self, cell_size=GRID_CELL):
+        self.cell_size = cell_size
+        self.pens = []
+        self._pen_ids = {}
+        self.strokes = {}  # id -> Stroke, in drawing order
+        self.grid = {}  # (cx, cy) -> ids of strokes crossing that cell
+        self._newest = {}  # (cx, cy) -> highest id of a stroke crossing that cell
+        self._open = OrderedDict()  # (pen, x, y) -> line stroke ending at that point
+        self._open_sprays = {}  # pen -> spray stroke
+        self._next_id = 0
+
+    def intern_pen(self, key):
+        pen = self._pen_ids.get(key)
+        if pen is None:
+            pen = self._pen_ids[key] = len(self.pens)
+            self.pens.append(key)
+        return pen
+
+    def _new_stroke(self, kind, pen):
+        stroke = Stroke(self._next_id, kind, pen)
+        self._next_id += 1
+        self.strokes[stroke.id] = stroke
+        return stroke
+
+    def _index(self, stroke, bounds):
+        left, top, right, bottom = bounds
+        if stroke.bounds is not None:
+            old = stroke.bounds
+            stroke.bounds = min(old[0], left), min(old[1], top), max(old[2], right), max(old[3], bottom)
+        else:
+            stroke.bounds = bounds
+        size = self.cell_size
+        for cy in range(top // size, bottom // size + 1):
+            for cx in range(left // size, right // size + 1):
+                self.grid.setdefault((cx, cy), set()).add(stroke.id)
+                self._newest[(cx, cy)] = max(self._newest.get((cx, cy), -1), stroke.id)
+
+    def _covered(self, stroke, bounds):
+        """Whether a newer stroke may cross bounds, so extending stroke there would draw beneath it."""
+        left, top, right, bottom = bounds
+        size = self.cell_size
+        for cy in range(top // size, bottom // size + 1):
+            for cx in range(left // size, right // size + 1):
+                if self._newest.get((cx, cy), -1) > stroke.id:
+                    return True
+        return False
+
+    def add_segments(self, segments):
+        """Record drawn segments and sprays, extending the strokes they continue."""
+        for segment in segments:
+            if is_spray(segment):
+                self._add_spray(segment)
+            else:
+                self._add_line(segment)
+
+    def _add_line(self, segment):
+        pen = self.intern_pen(pen_key(segment))
+        x1, y1 = segment["last_point_x"], segment["last_point_y"]
+        x2, y2 = segment["current_point_x"], segment["current_point_y"]
+        bounds = segment_bounds(segment)
+        stroke = self._open.pop((pen, x1, y1), None)
+        if stroke is None or self._covered(stroke, bounds):
+            stroke = self._new_stroke(LINE, pen)
+            stroke.points.extend((x1, y1))
+        stroke.points.extend((x2, y2))
+        self._open[(pen, x2, y2)] = stroke
+        if len(self._open) > OPEN_STROKES:
+            self._open.popitem(last=False)
+        self._index(stroke, bounds)
+
+    def _add_spray(self, spray):
+        pen = self.intern_pen(("spray", spray["pen_color"], spray["diameter"], spray["density"]))
+        stroke = self._open_sprays.get(pen)
+        reach = SPRAY_JOIN_DISTANCE * spray["diameter"]
+        bounds = segment_bounds(spray)
+        if (stroke is None or abs(stroke.points[-3] - spray["x"]) > reach
+                or abs(stroke.points[-2] - spray["y"]) > reach or self._covered(stroke, bounds)):
+            stroke = self._open_sprays[pen] = self._new_stroke(SPRAY, pen)
+        stroke.points.extend((spray["x"], spray["y"], spray["spray_seed"]))
+        self._index(stroke, bounds)
+
+    def query(self, left, top, right, bottom):
+        """Strokes whose bounds intersect the inclusive rectangle, in drawing order."""
+        size = self.cell_size
+        ids = set()
+        for cy in range(top // size, bottom // size + 1):
+            for cx in range(left // size, right // size + 1):
+                ids.update(self.grid.get((cx, cy), ()))
+        found = []
+        for stroke_id in sorted(ids):
+            stroke = self.strokes[stroke_id]
+            s_left, s_top, s_right, s_bottom = stroke.bounds
+            if s_left <= right and left <= s_right and s_top <= bottom and top <= s_bottom:
+                found.append(stroke)
+        return found
+
+    def freeze(self, regions):
+        """A separate store holding copies of the strokes crossing any of the regions.
+
+        The copy can be queried and drawn from another thread while this store
+        keeps growing on the GUI thread.
+        """
+        frozen = StrokeStore(self.cell_size)
+        frozen.pens = list(self.pens)
+        for bounds in regions:
+            for stroke in self.query(*bounds):
+                if stroke.id not in frozen.strokes:
+                    copy = frozen.strokes[stroke.id] = stroke.frozen()
+                    frozen._index(copy, stroke.bounds)
+        frozen.strokes = dict(sorted(frozen.strokes.items()))
+        return frozen
+
+    def clear(self):
+        self.pens.clear()
+        self._pen_ids.clear()
+        self.strokes.clear()
+        self.grid.clear()
+        self._newest.clear()
+        self._open.clear()
+        self._open_sprays.clear()
+
+    def __len__(self):
+        return len(self.strokes)
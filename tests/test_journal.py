@@ -0,0 +1,63 @@
+import os
+
+from journal import BoardCheckpoint, StrokeJournal
+
+
+def records(journal, start=0):
+    return [(board, bytes(payload)) for _, board, payload in journal.replay(start)]
+
+
+def write(path, entries):
+    journal = StrokeJournal(path, commit_interval=0)
+    journal.start()
+    for board, payload in entries:
+        journal.append(board, payload)
+    journal.close()
+
+
+def test_replay_returns_every_record_in_order(tmp_path):
+    path = str(tmp_path / "journal")
+    entries = [("a", b"one"), ("b", b"two"), ("a", b"three" * 100)]
+    write(path, entries)
+    assert records(StrokeJournal(path)) == entries
+
+
+def test_torn_tail_is_dropped_and_truncated(tmp_path):
+    path = str(tmp_path / "journal")
+    write(path, [("a", b"one"), ("a", b"two")])
+    with open(path, "ab") as f:
+        f.write(b"\0\0\0\x40partial")
+    journal = StrokeJournal(path, commit_interval=0)
+    assert records(journal) == [("a", b"one"), ("a", b"two")]
+    journal.start()
+    journal.append("a", b"three")
+    journal.close()
+    assert records(StrokeJournal(path)) == [("a", b"one"), ("a", b"two"), ("a", b"three")]
+
+
+def test_checkpoint_restart_replays_only_newer_records(tmp_path):
+    path = str(tmp_path / "journal")
+    journal = StrokeJournal(path, commit_interval=0)
+    journal.start()
+    journal.append("a", b"old")
+    offset = journal.appended_size
+    assert journal.write_snapshot(offset, [BoardCheckpoint("a", offset, 1, [b"chunk"], [b"pending"])])
+    journal.append("a", b"new")
+    journal.close()
+
+    journal = StrokeJournal(path)
+    start, (checkpoint,) = journal.load_snapshot()
+    assert (start, checkpoint.board, checkpoint.sequence) == (offset, "a", 1)
+    assert [bytes(p) for p in checkpoint.chunks] == [b"chunk"] and [bytes(p) for p in checkpoint.pending] == [b"pending"]
+    assert records(journal, start) == [("a", b"new")]
+
+
+def test_snapshot_past_the_journal_is_ignored(tmp_path):
+    path = str(tmp_path / "journal")
+    write(path, [("a", b"one")])
+    journal = StrokeJournal(path, commit_interval=0)
+    journal.start()
+    journal.write_snapshot(journal.appended_size, [])
+    journal.close()
+    os.truncate(path, 0)
+    assert StrokeJournal(path).load_snapshot() is None
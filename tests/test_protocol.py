@@ -0,0 +1,61 @@
+import pytest
+
+from protocol import (BINARY_CODEC, JSON_CODEC, FrameDecoder, ProtocolError, check_stroke_payload, decode_ack,
+                      decode_payload, decode_sequenced, decode_strokes, encode_ack, encode_frame, encode_json,
+                      encode_segments, encode_sequenced, encode_strokes, transcode_frame)
+
+PEN = {"pen_color": 0x80FF0000, "pen_width": 5, "pen_style": "dash", "pen_cap": "square"}
+
+
+def line(x1, y1, x2, y2, **pen):
+    return {"last_point_x": x1, "last_point_y": y1, "current_point_x": x2, "current_point_y": y2, **(pen or PEN)}
+
+
+def spray(x, y):
+    return {"spray_seed": 7, "x": x, "y": y, "diameter": 20, "density": 100, "pen_color": 0xFF00FF00}
+
+
+SEGMENTS = [
+    line(0, 0, 10, 5), line(10, 5, 12, -3), spray(40, 40), line(12, -3, 20, 0),
+    line(-20000, 5, 10000, 5),
+    line(3, 3, 4, 4, pen_color=1, pen_width=1, pen_style="solid", pen_cap="round"),
+]
+
+
+def test_binary_round_trip_keeps_segments_and_order():
+    assert decode_strokes(encode_strokes(SEGMENTS)) == SEGMENTS
+
+
+def test_frames_survive_arbitrary_splits():
+    payloads = [encode_strokes(SEGMENTS), encode_json(SEGMENTS), b"{}"]
+    stream = b"".join(encode_frame(payload) for payload in payloads)
+    decoder = FrameDecoder()
+    received = []
+    for start in range(0, len(stream), 7):
+        received += decoder.feed(stream[start:start + 7])
+    assert received == payloads
+
+
+def test_sequenced_and_acked_payloads_transcode_inside_their_envelope():
+    binary = encode_strokes(SEGMENTS)
+    frames = FrameDecoder().feed(transcode_frame(encode_sequenced(42, binary), JSON_CODEC))
+    order, payload = decode_sequenced(frames[0])
+    assert order == 42 and decode_payload(payload) == SEGMENTS
+    frames = FrameDecoder().feed(transcode_frame(memoryview(encode_ack(3, 9, binary)), JSON_CODEC))
+    assert decode_ack(frames[0])[:2] == (3, 9) and decode_payload(decode_ack(frames[0])[2]) == SEGMENTS
+
+
+@pytest.mark.parametrize("codec", [BINARY_CODEC, JSON_CODEC])
+def test_encoded_batches_pass_the_ingest_check(codec):
+    frame = encode_segments(SEGMENTS, codec)
+    check_stroke_payload(FrameDecoder().feed(frame)[0])
+
+
+@pytest.mark.parametrize("payload", [
+    b"\x01\x00\x05", encode_strokes(SEGMENTS)[:-1], encode_strokes(SEGMENTS) + b"\0", b"[1]", b"not json",
+    b'{"type": "joined", "board": "x"}', encode_json([dict(line(0, 0, 1, 1), pen_style="dotted")]),
+    encode_json([dict(line(0, 0, 1, 1), pen_width=1000)]),
+])
+def test_malformed_payloads_are_rejected(payload):
+    with pytest.raises(ProtocolError):
+        check_stroke_payload(payload)
@@ -0,0 +1,82 @@
+import socket
+import threading
+import time
+
+from outbox import SendBuffer
+from protocol import FrameDecoder, decode_ack, decode_sequenced, encode_segments, is_ack, is_sequenced
+from relay import ClusterNode, HashRing, LoopbackBus, TcpEndpoint
+from server import Peer, RelayServer
+
+PEN = {"pen_color": 0xFF0000FF, "pen_width": 3, "pen_style": "solid", "pen_cap": "round"}
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def connect(server, key):
+    peer = Peer(object(), key, key=key)
+    peer.codec = "binary"
+    server.clients.add(peer)
+    return peer
+
+
+def orders(peer):
+    """Board orders of the strokes queued for a peer, acks included."""
+    numbers = []
+    for frame in peer.outbox._take():
+        payload = FrameDecoder().feed(frame)[0]
+        if is_sequenced(payload):
+            numbers.append(decode_sequenced(payload)[0])
+        elif is_ack(payload):
+            numbers.append(decode_ack(payload)[0])
+    return numbers
+
+
+def test_two_nodes_see_one_order_per_board():
+    bus = LoopbackBus()
+    nodes = ["a", "b"]
+    servers = {}
+    for name in nodes:
+        node = ClusterNode(name, nodes, bus)
+        servers[name] = RelayServer(node=node)
+        node.start(servers[name].handle_relay)
+    board = next(f"board{i}" for i in range(100) if HashRing(nodes).owner(f"board{i}") == "a")
+    drawers = {name: connect(servers[name], f"{name}/drawer") for name in nodes}
+    watchers = {name: connect(servers[name], f"{name}/watcher") for name in nodes}
+    for name in nodes:
+        servers[name].join_board(drawers[name], board)
+        servers[name].join_board(watchers[name], board)
+    wait_for(lambda: servers["b"].node.synced(board))
+
+    def draw(name):
+        for i in range(200):
+            segment = {"last_point_x": i, "last_point_y": 0, "current_point_x": i + 1, "current_point_y": 0, **PEN}
+            servers[name].handle_payload(FrameDecoder().feed(encode_segments([segment], "binary", i + 1))[0],
+                                         drawers[name])
+
+    threads = [threading.Thread(target=draw, args=(name,)) for name in nodes]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wait_for(lambda: servers["b"].boards.get(board).sequence == 400)
+    wait_for(lambda: len(watchers["b"].outbox) >= 400)
+    seen = {name: orders(watchers[name]) for name in nodes}
+    assert seen["a"] == seen["b"] == list(range(1, 401))
+    for name in nodes:
+        wait_for(lambda: len(drawers[name].outbox) >= 400)
+        assert sorted(orders(drawers[name])) == list(range(1, 401))
+
+
+def test_endpoint_drops_sends_once_the_hub_is_gone():
+    ours, theirs = socket.socketpair()
+    endpoint = TcpEndpoint(ours, "a", lambda *message: None)
+    theirs.close()
+    wait_for(lambda: endpoint.outbox.closed)
+    endpoint.send("b", 0, "board", "a/1", b"x" * 1000)
+    assert endpoint.dropped == 1
+    assert isinstance(endpoint.outbox, SendBuffer) and len(endpoint.outbox) == 0